@@ -1,12 +1,40 @@
 import sh
 import streamlit as st
 import pandas as pd
+import numpy as np
 import gspread
 from google.oauth2 import service_account
+from collections import OrderedDict, deque, namedtuple
+from contextlib import ExitStack, contextmanager
+import heapq
 from datetime import datetime
 import altair as alt
+import qrcode
+from googleapiclient.discovery import build as build_api
+from googleapiclient.errors import HttpError
 from streamlit_option_menu import option_menu
+import requests
+from requests.adapters import HTTPAdapter
+import base64
+import functools
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import socket
+import sqlite3
+import tempfile
+import threading
 import time
+import uuid
+import zipfile
+from abc import ABC, abstractmethod
+from urllib.parse import urlencode
 
 # ======================================================
 # 🔹 ESTILOS PERSONALIZADOS
@@ -79,84 +107,3431 @@ st.markdown("""
 # 🔹 UTILIDADES
 # ======================================================
 
+SCOPES_SHEETS = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+]
+
+
+def _sesion_http(gc):
+    """Devuelve la sesión requests del cliente gspread (v5: gc.session, v6: gc.http_client.session)."""
+    http_client = getattr(gc, "http_client", None)
+    return getattr(http_client, "session", None) or gc.session
+
+
+def _fijar_timeout(gc, timeout):
+    """Límite de tiempo de cada petición del cliente gspread (v5: gc.set_timeout, v6: gc.http_client)."""
+    getattr(gc, "http_client", gc).set_timeout(timeout)
+
+
+# Límites superiores (segundos) de los buckets del histograma de latencias
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricasAPI:
+    """
+    Contadores e histogramas de latencia de las llamadas a la API de Google.
+
+    Cada llamada se etiqueta con la operación (authorize, open_by_key,
+    worksheet, get_all_records, append_rows, ...) y con el módulo que la
+    originó. El módulo se fija por hilo con `modulo(nombre)`; las llamadas de
+    hilos en segundo plano quedan etiquetadas con el nombre del hilo.
+    """
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._contexto = threading.local()
+        self._series = {}
+
+    def modulo_actual(self):
+        return getattr(self._contexto, "modulo", None) or threading.current_thread().name
+
+    @contextmanager
+    def modulo(self, nombre):
+        """Atribuye a `nombre` las llamadas hechas por este hilo dentro del bloque."""
+        anterior = getattr(self._contexto, "modulo", None)
+        self._contexto.modulo = nombre
+        try:
+            yield
+        finally:
+            self._contexto.modulo = anterior
+
+    @contextmanager
+    def medir(self, operacion):
+        """Cuenta y cronometra la llamada del bloque; las excepciones cuentan como error."""
+        inicio = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.registrar(operacion, time.perf_counter() - inicio, error)
+
+    def registrar(self, operacion, segundos, error=False, modulo=None):
+        clave = (operacion, modulo or self.modulo_actual())
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = {
+                    "llamadas": 0, "errores": 0, "segundos": 0.0, "buckets": [0] * len(self.buckets)
+                }
+            serie["llamadas"] += 1
+            serie["errores"] += int(error)
+            serie["segundos"] += segundos
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    serie["buckets"][i] += 1
+                    break
+
+    def reiniciar(self):
+        with self._lock:
+            self._series = {}
+
+    def _copia(self):
+        with self._lock:
+            return {clave: dict(serie, buckets=list(serie["buckets"])) for clave, serie in self._series.items()}
+
+    def _percentil(self, serie, q):
+        """Percentil aproximado: límite superior del bucket donde cae el q-ésimo valor."""
+        objetivo = q * serie["llamadas"]
+        acumulado = 0
+        for limite, n in zip(self.buckets, serie["buckets"]):
+            acumulado += n
+            if acumulado >= objetivo:
+                return limite
+        return float("inf")
+
+    def resumen(self):
+        """
+        Tabla con una fila por (módulo, operación).
+
+        :return: DataFrame con llamadas, errores, latencia media y p95 aproximado en ms
+        """
+        filas = [
+            {
+                "Módulo": modulo,
+                "Operación": operacion,
+                "Llamadas": serie["llamadas"],
+                "Errores": serie["errores"],
+                "Latencia media (ms)": round(1000 * serie["segundos"] / serie["llamadas"], 1),
+                "p95 (ms) ≤": 1000 * self._percentil(serie, 0.95),
+            }
+            for (operacion, modulo), serie in self._copia().items()
+        ]
+        columnas = ["Módulo", "Operación", "Llamadas", "Errores", "Latencia media (ms)", "p95 (ms) ≤"]
+        return pd.DataFrame(filas, columns=columnas).sort_values(
+            ["Llamadas", "Módulo"], ascending=[False, True], ignore_index=True
+        )
+
+    def exportar_prometheus(self, prefijo="sheets_api"):
+        """Devuelve las métricas en el formato de texto de Prometheus."""
+        series = sorted(self._copia().items())
+
+        def etiquetas(operacion, modulo, **extra):
+            pares = {"modulo": modulo, "operacion": operacion, **extra}
+            texto = ",".join(
+                f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                for k, v in pares.items()
+            )
+            return "{" + texto + "}"
+
+        lineas = [
+            f"# HELP {prefijo}_llamadas_total Llamadas a la API de Google Sheets.",
+            f"# TYPE {prefijo}_llamadas_total counter",
+        ]
+        lineas += [f"{prefijo}_llamadas_total{etiquetas(*clave)} {serie['llamadas']}" for clave, serie in series]
+        lineas += [
+            f"# HELP {prefijo}_errores_total Llamadas a la API de Google Sheets que fallaron.",
+            f"# TYPE {prefijo}_errores_total counter",
+        ]
+        lineas += [f"{prefijo}_errores_total{etiquetas(*clave)} {serie['errores']}" for clave, serie in series]
+        lineas += [
+            f"# HELP {prefijo}_latencia_segundos Latencia de las llamadas a la API de Google Sheets.",
+            f"# TYPE {prefijo}_latencia_segundos histogram",
+        ]
+        for clave, serie in series:
+            acumulado = 0
+            for limite, n in zip(self.buckets, serie["buckets"]):
+                acumulado += n
+                lineas.append(f"{prefijo}_latencia_segundos_bucket{etiquetas(*clave, le=limite)} {acumulado}")
+            lineas.append(f"{prefijo}_latencia_segundos_bucket{etiquetas(*clave, le='+Inf')} {serie['llamadas']}")
+            lineas.append(f"{prefijo}_latencia_segundos_sum{etiquetas(*clave)} {serie['segundos']:.6f}")
+            lineas.append(f"{prefijo}_latencia_segundos_count{etiquetas(*clave)} {serie['llamadas']}")
+        return "\n".join(lineas) + "\n"
+
+
+class ObjetoInstrumentado:
+    """Envuelve un objeto de gspread y pasa cada método invocado por `ejecutar(operacion, funcion, ...)`."""
+
+    def __init__(self, objeto, ejecutar):
+        self._objeto = objeto
+        self._ejecutar = ejecutar
+
+    def __getattr__(self, nombre):
+        atributo = getattr(self._objeto, nombre)
+        if not callable(atributo):
+            return atributo
+
+        @functools.wraps(atributo)
+        def medido(*args, **kwargs):
+            return self._ejecutar(nombre, atributo, *args, **kwargs)
+        return medido
+
+
+# Carriles de prioridad del planificador (menor número = se atiende antes)
+PRIORIDAD_VOTOS = 0
+PRIORIDAD_INTERACTIVA = 1
+PRIORIDAD_TABLEROS = 2
+
+# Lecturas que pueden esperar: tableros y sondeos de resultados
+PRIORIDAD_POR_MODULO = {
+    "envio-votos": PRIORIDAD_VOTOS,
+    "modulo_dashboard": PRIORIDAD_TABLEROS,
+    "modulo_resultados": PRIORIDAD_TABLEROS,
+    "sondeo-resultados": PRIORIDAD_TABLEROS,
+    "espejo-sheets": PRIORIDAD_TABLEROS,
+    "indice-docentes": PRIORIDAD_TABLEROS,
+}
+
+OPERACIONES_ESCRITURA = frozenset({
+    "append_row", "append_rows", "insert_row", "insert_rows", "update", "update_cell", "update_cells",
+    "batch_update", "batch_clear", "clear", "delete_rows", "values_append", "values_update",
+    "values_batch_update", "values_clear",
+})
+
+
+class CuotaAgotada(Exception):
+    """No hubo cupo de la API a tiempo para una llamada de baja prioridad."""
+
+
+class CubetaTokens:
+    """
+    Token bucket con cola por prioridad.
+
+    Se recarga a `por_minuto / 60` tokens por segundo hasta `capacidad`. Los
+    hilos en espera se atienden por prioridad y, dentro de cada carril, en
+    orden de llegada. Cada carril deja intacta una reserva de tokens para
+    los carriles más prioritarios.
+    """
+
+    def __init__(self, por_minuto, capacidad=None, reserva=None):
+        self.por_segundo = por_minuto / 60.0
+        self.capacidad = capacidad or max(1, por_minuto // 6)
+        self.reserva = reserva or {
+            PRIORIDAD_VOTOS: 0,
+            PRIORIDAD_INTERACTIVA: 0,
+            PRIORIDAD_TABLEROS: self.capacidad * 0.25,
+        }
+        self.tokens = float(self.capacidad)
+        self._ultimo = time.monotonic()
+        self._condicion = threading.Condition()
+        self._cola = []
+        self._turnos = 0
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def adquirir(self, prioridad, espera_maxima=None):
+        """
+        Espera un token respetando la prioridad.
+
+        :param prioridad: carril (PRIORIDAD_VOTOS, PRIORIDAD_INTERACTIVA, PRIORIDAD_TABLEROS)
+        :param espera_maxima: segundos máximos de espera (None = sin límite)
+        :return: True si obtuvo el token, False si se agotó la espera
+        """
+        with self._condicion:
+            self._turnos += 1
+            turno = (prioridad, self._turnos)
+            heapq.heappush(self._cola, turno)
+            limite = None if espera_maxima is None else time.monotonic() + espera_maxima
+            try:
+                while True:
+                    self._recargar()
+                    necesarios = min(1 + self.reserva.get(prioridad, 0), self.capacidad)
+                    if self._cola[0] == turno and self.tokens >= necesarios:
+                        self.tokens -= 1
+                        return True
+                    espera = max(necesarios - self.tokens, 0.05) / self.por_segundo
+                    if limite is not None:
+                        restante = limite - time.monotonic()
+                        if restante <= 0:
+                            return False
+                        espera = min(espera, restante)
+                    self._condicion.wait(espera)
+            finally:
+                self._cola.remove(turno)
+                heapq.heapify(self._cola)
+                self._condicion.notify_all()
+
+    def vaciar(self):
+        """Descarta los tokens disponibles (Google respondió 429: la cuota real ya se agotó)."""
+        with self._condicion:
+            self._recargar()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class CircuitoAbierto(Exception):
+    """Google viene fallando: la llamada se rechaza sin intentarla."""
+
+
+class InterruptorCircuito:
+    """
+    Interruptor de circuito para la API de Sheets.
+
+    Tras `umbral` fallos seguidos del servicio (5xx, timeouts o errores de
+    conexión) se abre y rechaza las llamadas al instante durante
+    `enfriamiento` segundos, para que las sesiones no se acumulen esperando a
+    un servicio caído. Luego deja pasar una sola llamada de prueba
+    (semiabierto): si responde se cierra y si falla vuelve a abrirse. Un 429 o
+    un 4xx no cuentan como fallo: el servicio respondió.
+    """
+
+    CERRADO, ABIERTO, SEMIABIERTO = "cerrado", "abierto", "semiabierto"
+
+    def __init__(self, umbral=5, enfriamiento=30.0):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.estado = self.CERRADO
+        self.aperturas = 0
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_en = 0.0
+        self._prueba_en_curso = False
+
+    def abierto(self):
+        """True si ahora mismo se rechazaría una llamada (sin reservar la prueba)."""
+        with self._lock:
+            if self.estado == self.ABIERTO:
+                return time.monotonic() - self._abierto_en < self.enfriamiento
+            return self.estado == self.SEMIABIERTO and self._prueba_en_curso
+
+    def reintento_en(self):
+        """Segundos que faltan para la próxima llamada de prueba (0 si el circuito está cerrado)."""
+        with self._lock:
+            if self.estado != self.ABIERTO:
+                return 0.0
+            return max(0.0, self.enfriamiento - (time.monotonic() - self._abierto_en))
+
+    def permitir(self):
+        """
+        Decide si la llamada puede hacerse; en semiabierto solo la primera pasa.
+
+        :return: True si la llamada puede hacerse
+        """
+        with self._lock:
+            if self.estado == self.ABIERTO and time.monotonic() - self._abierto_en >= self.enfriamiento:
+                self.estado = self.SEMIABIERTO
+                self._prueba_en_curso = False
+            if self.estado == self.CERRADO:
+                return True
+            if self.estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            self._fallos = 0
+            if self.estado != self.CERRADO:
+                logger.info("Circuito de la API de Sheets cerrado: el servicio volvió a responder")
+            self.estado = self.CERRADO
+            self._prueba_en_curso = False
+
+    def fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self.estado == self.SEMIABIERTO or (self.estado == self.CERRADO and self._fallos >= self.umbral):
+                self.estado = self.ABIERTO
+                self._abierto_en = time.monotonic()
+                self._prueba_en_curso = False
+                self.aperturas += 1
+                logger.warning("Circuito de la API de Sheets abierto tras %d fallos; se reintenta en %.0f s",
+                               self._fallos, self.enfriamiento)
+
+
+class PlanificadorCuota:
+    """
+    Punto único por el que pasan todas las llamadas a la API de Sheets.
+
+    Aplica un token bucket para lecturas y otro para escrituras según la
+    cuota del proyecto, da prioridad a los votos sobre las lecturas de
+    tableros y reintenta con backoff exponencial con jitter. Las lecturas se
+    reintentan ante 429, 5xx y timeouts; las escrituras solo ante 429, porque
+    un 5xx no garantiza que el append no se haya aplicado (de eso se encarga
+    la conciliación del diario de votos). Los reintentos de una lectura no
+    pasan de `plazo_lecturas` segundos en total, y los fallos del servicio
+    alimentan un interruptor de circuito: abierto, las llamadas fallan al instante.
+    """
+
+    def __init__(self, metricas, lecturas_por_minuto=60, escrituras_por_minuto=60, reintentos=5,
+                 espera_base=1.0, espera_maxima=32.0, espera_tableros=2.0, plazo_lecturas=10.0, circuito=None):
+        self.metricas = metricas
+        self.lecturas = CubetaTokens(lecturas_por_minuto)
+        self.escrituras = CubetaTokens(escrituras_por_minuto)
+        self.circuito = circuito or InterruptorCircuito()
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.espera_tableros = espera_tableros
+        self.plazo_lecturas = plazo_lecturas
+
+    def prioridad(self, operacion):
+        if operacion in OPERACIONES_ESCRITURA:
+            return PRIORIDAD_VOTOS
+        return PRIORIDAD_POR_MODULO.get(self.metricas.modulo_actual(), PRIORIDAD_INTERACTIVA)
+
+    @staticmethod
+    def _codigo(error):
+        respuesta = getattr(error, "response", None)
+        return getattr(respuesta, "status_code", None)
+
+    def _falla_servicio(self, error):
+        """Errores que indican que Google no está respondiendo (no cuota ni petición inválida)."""
+        codigo = self._codigo(error)
+        return (codigo is not None and codigo >= 500) or isinstance(
+            error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+        )
+
+    def _reintentable(self, error, escritura):
+        if self._codigo(error) == 429:
+            return True
+        return not escritura and self._falla_servicio(error)
+
+    def ejecutar(self, operacion, funcion, *args, **kwargs):
+        """
+        Ejecuta `funcion(*args, **kwargs)` cuando haya cupo, con métricas y reintentos.
+
+        :raises CuotaAgotada: si una lectura de tableros no obtuvo cupo a tiempo
+        :raises CircuitoAbierto: si el interruptor de circuito está abierto
+        """
+        escritura = operacion in OPERACIONES_ESCRITURA
+        cubeta = self.escrituras if escritura else self.lecturas
+        prioridad = self.prioridad(operacion)
+        espera = self.espera_tableros if prioridad == PRIORIDAD_TABLEROS else None
+        reintentos = 1 if prioridad == PRIORIDAD_TABLEROS else self.reintentos
+        limite = None if escritura else time.monotonic() + self.plazo_lecturas
+        intento = 0
+        while True:
+            # Con el circuito abierto no se espera turno: se falla al instante
+            if self.circuito.abierto():
+                raise CircuitoAbierto(
+                    f"API de Sheets no disponible; se reintenta en {self.circuito.reintento_en():.0f} s"
+                )
+            if not cubeta.adquirir(prioridad, espera):
+                raise CuotaAgotada(f"Sin cupo de la API de Sheets para {operacion}")
+            if not self.circuito.permitir():
+                raise CircuitoAbierto(f"API de Sheets no disponible ({operacion})")
+            try:
+                with self.metricas.medir(operacion):
+                    resultado = funcion(*args, **kwargs)
+                self.circuito.exito()
+                return resultado
+            except Exception as e:
+                if self._falla_servicio(e):
+                    self.circuito.fallo()
+                else:
+                    self.circuito.exito()
+                if self._codigo(e) == 429:
+                    cubeta.vaciar()
+                if intento >= reintentos or not self._reintentable(e, escritura) or self.circuito.abierto():
+                    raise
+                pausa = random.uniform(0, min(self.espera_maxima, self.espera_base * 2 ** intento))
+                if limite is not None and time.monotonic() + pausa > limite:
+                    raise
+                logger.info("Reintentando %s en %.1f s (%s)", operacion, pausa, e)
+                intento += 1
+                time.sleep(pausa)
+
+
+class ColaLlena(Exception):
+    """La fila de espera está completa: se rechaza en lugar de encolar sin límite."""
+
+    def __init__(self, espera_estimada):
+        super().__init__(f"Fila de espera completa; intenta de nuevo en {espera_estimada:.0f} s")
+        self.espera_estimada = espera_estimada
+
+
+class ControlAdmision:
+    """
+    Control de admisión con fila FIFO compartida por todas las sesiones.
+
+    Como mucho `concurrentes` sesiones ejecutan a la vez la parte que toca el
+    almacenamiento; las demás esperan su turno en orden de llegada, así una
+    ráfaga (todo el auditorio escaneando el QR) se atiende al ritmo que la
+    API sostiene en vez de convertirse en reintentos. Con `max_cola` sesiones
+    esperando, las nuevas se rechazan al instante (contrapresión). La espera
+    estimada se basa en la duración media de los turnos (media móvil
+    exponencial). Un turno no liberado en `vigencia` segundos se reclama.
+    """
+
+    def __init__(self, concurrentes=8, max_cola=500, vigencia=60.0, duracion_inicial=0.5):
+        self.concurrentes = concurrentes
+        self.max_cola = max_cola
+        self.vigencia = vigencia
+        self.duracion_media = duracion_inicial
+        self.admitidos = 0
+        self.rechazados = 0
+        self._condicion = threading.Condition()
+        self._cola = deque()
+        self._activos = {}  # ticket -> instante de admisión
+        self._tickets = 0
+
+    def _reclamar_vencidos(self):
+        ahora = time.monotonic()
+        for ticket, inicio in list(self._activos.items()):
+            if ahora - inicio > self.vigencia:
+                del self._activos[ticket]
+                logger.warning("Turno de admisión %d reclamado tras %.0f s sin liberarse", ticket, ahora - inicio)
+
+    def _admitir(self):
+        self._reclamar_vencidos()
+        while self._cola and len(self._activos) < self.concurrentes:
+            self._activos[self._cola.popleft()] = time.monotonic()
+            self.admitidos += 1
+        self._condicion.notify_all()
+
+    def _espera_estimada(self, posicion):
+        return -(-posicion // self.concurrentes) * self.duracion_media
+
+    def solicitar(self):
+        """
+        Toma un ticket al final de la fila (o entra directo si hay cupo).
+
+        :return: ticket para `esperar`, `posicion` y `liberar`
+        :raises ColaLlena: si ya hay `max_cola` sesiones esperando
+        """
+        with self._condicion:
+            if len(self._cola) >= self.max_cola:
+                self.rechazados += 1
+                raise ColaLlena(self._espera_estimada(len(self._cola)))
+            self._tickets += 1
+            self._cola.append(self._tickets)
+            self._admitir()
+            return self._tickets
+
+    def esperar(self, ticket, timeout):
+        """
+        Espera el turno del ticket como mucho `timeout` segundos.
+
+        :return: True si ya fue admitido
+        """
+        limite = time.monotonic() + timeout
+        with self._condicion:
+            while ticket not in self._activos:
+                restante = limite - time.monotonic()
+                if restante <= 0 or ticket not in self._cola:
+                    return False
+                self._condicion.wait(min(restante, 1.0))
+                self._admitir()
+            return True
+
+    def posicion(self, ticket):
+        """
+        :return: (posición en la fila empezando en 1, o 0 si ya fue admitido; segundos estimados de espera)
+        """
+        with self._condicion:
+            try:
+                posicion = self._cola.index(ticket) + 1
+            except ValueError:
+                return 0, 0.0
+            return posicion, self._espera_estimada(posicion)
+
+    def liberar(self, ticket):
+        """Termina el turno (o abandona la fila) y deja pasar al siguiente."""
+        with self._condicion:
+            inicio = self._activos.pop(ticket, None)
+            if inicio is not None:
+                self.duracion_media = 0.8 * self.duracion_media + 0.2 * (time.monotonic() - inicio)
+            else:
+                try:
+                    self._cola.remove(ticket)
+                except ValueError:
+                    pass
+            self._admitir()
+
+    def estado(self):
+        """:return: (turnos activos, sesiones en fila)"""
+        with self._condicion:
+            return len(self._activos), len(self._cola)
+
+
+@st.cache_resource(show_spinner=False)
+def _control_admision_compartido(concurrentes, max_cola):
+    return ControlAdmision(concurrentes, max_cola)
+
+
+def obtener_control_admision(secrets):
+    """
+    Control de admisión del proceso para la votación. Se configura en
+    `[admision]` de secrets (por defecto 8 turnos simultáneos y 500 en fila).
+    """
+    config = secrets.get("admision", {})
+    return _control_admision_compartido(int(config.get("concurrentes", 8)), int(config.get("max_cola", 500)))
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_metricas_api():
+    """Devuelve las métricas de la API compartidas por todo el proceso."""
+    return MetricasAPI()
+
+
+def atribuir_modulo(nombre):
+    """
+    Decorador que atribuye a `nombre` las llamadas a la API hechas por la función.
+
+    :param nombre: etiqueta del módulo, p. ej. "modulo_votacion"
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with obtener_metricas_api().modulo(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+class ConexionSheets:
+    """
+    Conexión a Google Sheets compartida por todo el proceso.
+
+    Autoriza una sola vez y reutiliza el token (google-auth lo refresca solo
+    cuando expira). La sesión HTTP mantiene conexiones keep-alive con un pool
+    amplio para atender muchas sesiones de Streamlit a la vez. Los handles de
+    spreadsheet y hojas se abren una vez y se reutilizan; el candado solo
+    protege su creación, las lecturas y escrituras van directo a la API.
+    Cada petición tiene un límite de tiempo `timeout_http` (conexión, lectura)
+    para que un servicio colgado no retenga las sesiones indefinidamente.
+    """
+
+    def __init__(self, info_gcp, spreadsheet_id, conexiones_http=64, metricas=None, planificador=None,
+                 vigencia_marca=2.0, timeout_http=(5, 30)):
+        self.info_gcp = info_gcp
+        self.spreadsheet_id = spreadsheet_id
+        self.conexiones_http = conexiones_http
+        self.timeout_http = timeout_http
+        self.metricas = metricas or MetricasAPI()
+        self.planificador = planificador or PlanificadorCuota(self.metricas)
+        self.vigencia_marca = vigencia_marca
+        self._lock = threading.RLock()
+        self._cliente = None
+        self._credenciales = None
+        self._spreadsheet = None
+        self._hojas = {}
+        self._lock_drive = threading.Lock()
+        self._drive = None
+        self._drive_disponible = True
+        self._marca = None
+        self._marca_en = 0.0
+        self._espera_drive = 0.0
+        self._reintentar_drive_en = 0.0
+
+    def cliente(self):
+        with self._lock:
+            if self._cliente is None:
+                credentials = service_account.Credentials.from_service_account_info(
+                    self.info_gcp, scopes=SCOPES_SHEETS
+                )
+                with self.metricas.medir("authorize"):
+                    gc = gspread.authorize(credentials)
+                adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=self.conexiones_http)
+                _sesion_http(gc).mount("https://", adaptador)
+                _fijar_timeout(gc, self.timeout_http)
+                self._credenciales = credentials
+                self._cliente = gc
+            return self._cliente
+
+    def marca_modificacion(self):
+        """
+        Marca de cambio del spreadsheet según Drive: `(version, modifiedTime)`.
+
+        Es una llamada de metadatos mucho más barata que descargar una hoja y
+        se reutiliza durante `vigencia_marca` segundos. La cuota de Drive es
+        aparte de la de Sheets, por eso no pasa por el planificador.
+
+        Solo un 403/404 (API deshabilitada o sin permiso) la desactiva para el
+        proceso; otros errores (red, discovery, 5xx, límite de tasa) se
+        reintentan con espera creciente, hasta 60 s.
+
+        :return: la marca, o None si no se pudo consultar (se descarga igual)
+        """
+        with self._lock_drive:
+            if not self._drive_disponible or time.monotonic() < self._reintentar_drive_en:
+                return None
+            if time.monotonic() - self._marca_en < self.vigencia_marca:
+                return self._marca
+            try:
+                if self._drive is None:
+                    self.cliente()
+                    self._drive = build_api("drive", "v3", credentials=self._credenciales, cache_discovery=False)
+                solicitud = self._drive.files().get(
+                    fileId=self.spreadsheet_id, fields="version,modifiedTime", supportsAllDrives=True
+                )
+                with self.metricas.medir("drive_files_get"):
+                    archivo = solicitud.execute()
+            except HttpError as e:
+                if e.status_code in (403, 404) and "rate limit" not in str(e).lower():
+                    # API de Drive deshabilitada en el proyecto o sin permiso: se usa solo el TTL
+                    self._drive_disponible = False
+                    logger.warning("Detección de cambios por Drive desactivada: %s", e)
+                else:
+                    self._fallo_drive(e)
+                return None
+            except Exception as e:
+                self._fallo_drive(e)
+                return None
+            self._marca = (archivo.get("version"), archivo.get("modifiedTime"))
+            self._marca_en = time.monotonic()
+            self._espera_drive = 0.0
+            return self._marca
+
+    def _fallo_drive(self, error):
+        """Error pasajero de Drive: se vuelve a intentar tras una espera que se duplica en cada fallo."""
+        self._espera_drive = min(max(self._espera_drive * 2, self.vigencia_marca), 60.0)
+        self._reintentar_drive_en = time.monotonic() + self._espera_drive
+        logger.warning("No se pudo consultar la marca de Drive (reintento en %.0f s): %s", self._espera_drive, error)
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                sh = self.ejecutar("open_by_key", self.cliente().open_by_key, self.spreadsheet_id)
+                self._spreadsheet = ObjetoInstrumentado(sh, self.ejecutar)
+            return self._spreadsheet
+
+    def hoja(self, nombre=None):
+        """
+        Devuelve el handle de la hoja indicada (o la primera si no se indica).
+
+        :param nombre: nombre de la hoja, p. ej. "Votaciones"
+        :return: gspread.Worksheet reutilizable entre sesiones (con métricas por llamada)
+        """
+        with self._lock:
+            if nombre not in self._hojas:
+                sh = self.spreadsheet()
+                if nombre:
+                    ws = sh.worksheet(nombre)
+                else:
+                    ws = sh.get_worksheet(0)
+                self._hojas[nombre] = ObjetoInstrumentado(ws, self.ejecutar)
+            return self._hojas[nombre]
+
+    def leer_rangos(self, rangos):
+        """
+        Lee varios rangos A1 (p. ej. "'Docentes'" o "'Votaciones'!A1:I") en una sola llamada.
+
+        :return: lista de filas (listas de strings) por rango, en el mismo orden
+        """
+        respuesta = self.spreadsheet().values_batch_get(list(rangos))
+        return [rango.get("values", []) for rango in respuesta.get("valueRanges", [])]
+
+    def leer_hojas(self, nombres):
+        """
+        Descarga varias hojas completas en una sola llamada a `values_batch_get`.
+
+        :param nombres: nombres de las hojas
+        :return: dict nombre -> DataFrame tipado según `ESQUEMAS_HOJAS`
+        """
+        rangos = [gspread.utils.absolute_range_name(nombre) for nombre in nombres]
+        return {nombre: hoja_tipada(nombre, valores) for nombre, valores in zip(nombres, self.leer_rangos(rangos))}
+
+    def ejecutar(self, operacion, funcion, *args, **kwargs):
+        """Hace una llamada a la API a través del planificador de cuota."""
+        return self.planificador.ejecutar(operacion, funcion, *args, **kwargs)
+
+    def reiniciar(self):
+        """Descarta cliente y handles (p. ej. si renombraron una hoja)."""
+        with self._lock:
+            self._cliente = None
+            self._spreadsheet = None
+            self._hojas = {}
+        with self._lock_drive:
+            self._drive = None
+            self._marca_en = 0.0
+
+
+@st.cache_resource(show_spinner=False)
+def _conexion_compartida(spreadsheet_id, lecturas_por_minuto, escrituras_por_minuto, _info_gcp):
+    metricas = obtener_metricas_api()
+    planificador = PlanificadorCuota(metricas, lecturas_por_minuto, escrituras_por_minuto)
+    return ConexionSheets(_info_gcp, spreadsheet_id, metricas=metricas, planificador=planificador)
+
+
+def obtener_conexion(secrets):
+    """
+    Devuelve la conexión compartida del proceso para el spreadsheet configurado.
+    La cuota se toma de `[cuota]` en secrets (por defecto 60 lecturas y 60
+    escrituras por minuto, la cuota por usuario de la API de Sheets).
+
+    :param secrets: credenciales de GCP desde st.secrets
+    :return: ConexionSheets (una sola instancia por proceso y spreadsheet)
+    """
+    cuota = secrets.get("cuota", {})
+    return _conexion_compartida(
+        secrets["spreadsheet"]["id"],
+        int(cuota.get("lecturas_por_minuto", 60)),
+        int(cuota.get("escrituras_por_minuto", 60)),
+        dict(secrets["gcp"]),
+    )
+
+
+# Segundos que una lectura de cada hoja se sirve desde caché
+TTL_HOJAS = {
+    "Docentes": 300,
+    "Respuestas de formulario 1": 60,
+    "Votaciones": 10,
+}
+TTL_POR_DEFECTO = 30
+
+COLUMNAS_VOTACIONES = [
+    "Fecha", "Rol Votante", "Correo", "Id_equipo", "Puntaje_Total", "Criterio 1", "Criterio 2", "Criterio 3",
+    "Id_voto"
+]
+
+CRITERIOS = ["Criterio 1", "Criterio 2", "Criterio 3"]
+
+# Tipo de cada columna por hoja (ver `tipar_columnas`); las no listadas quedan como texto.
+# Las de inscripciones usan los nombres ya normalizados por `normalizar_inscripciones`.
+ESQUEMAS_HOJAS = {
+    "Votaciones": {
+        "Fecha": "fecha",
+        "Rol Votante": "categoria",
+        "Correo": "texto",
+        "Id_equipo": "categoria",
+        "Puntaje_Total": "entero16",
+        "Criterio 1": "entero8",
+        "Criterio 2": "entero8",
+        "Criterio 3": "entero8",
+        "Id_voto": "texto",
+    },
+    "Docentes": {"Correo": "texto", "Codigo": "texto"},
+    "Respuestas de formulario 1": {
+        "Docente": "categoria",
+        "Participantes": "texto",
+        "Id_equipo": "categoria",
+        "Equipo": "texto",
+    },
+}
+
+RUTA_DIARIO_VOTOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "votos_pendientes.db")
+
+logger = logging.getLogger(__name__)
+
+
+class CacheHojas:
+    """
+    Caché de lecturas de hojas compartida por todas las sesiones del proceso.
+
+    Cada entrada guarda el DataFrame, el instante de carga y un número de
+    versión que aumenta con cada recarga o escritura. El TTL depende de la
+    hoja y el número de entradas está acotado (se descarta la menos usada).
+    Si varias sesiones piden una hoja vencida a la vez, solo una la descarga.
+    Una descarga que empezó antes de una escritura local (`agregar_filas`) no
+    se guarda, para no tapar la fila recién escrita con datos anteriores.
+
+    Con `marca` (función que devuelve la marca de modificación del archivo,
+    ver `ConexionSheets.marca_modificacion`), al vencer el TTL primero se
+    compara la marca: si no cambió, la entrada se renueva sin descargar.
+
+    Stale-while-revalidate: una entrada vencida se sirve al instante y se
+    revalida en un hilo en segundo plano, así una API lenta o caída no
+    bloquea a nadie que ya tenga datos. Solo la primera carga de una hoja
+    espera a Google; `edad` y `error` informan qué tan viejos son los datos.
+    """
+
+    def __init__(self, ttl_por_hoja=None, max_entradas=16, marca=None, revalidar_en_segundo_plano=True):
+        self.ttl_por_hoja = dict(TTL_HOJAS if ttl_por_hoja is None else ttl_por_hoja)
+        self.max_entradas = max_entradas
+        self.marca = marca
+        self.revalidar_en_segundo_plano = revalidar_en_segundo_plano
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (df, cargado_en, marca)
+        self._versiones = {}
+        self._escrituras = {}  # clave -> generación, sube con cada escritura local o invalidación
+        self._cargas = {}
+        self._errores = {}
+
+    def ttl(self, clave):
+        return self.ttl_por_hoja.get(clave, TTL_POR_DEFECTO)
+
+    def version(self, clave):
+        """Número de versión de los datos en caché para la clave."""
+        with self._lock:
+            return self._versiones.get(clave, 0)
+
+    def _vigente(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is not None and time.monotonic() - entrada[1] < self.ttl(clave):
+            self._entradas.move_to_end(clave)
+            return entrada[0]
+        return None
+
+    def _renovar_si_no_cambio(self, clave):
+        """Si la marca de modificación coincide con la de la entrada, la renueva y la devuelve."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        if self.marca is None or entrada is None or entrada[2] is None:
+            return None, None
+        marca = self.marca()
+        if marca is None or marca != entrada[2]:
+            return None, marca
+        with self._lock:
+            if self._entradas.get(clave) is not entrada:
+                return None, marca
+            self._entradas[clave] = (entrada[0], time.monotonic(), marca)
+            self._entradas.move_to_end(clave)
+            return entrada[0], marca
+
+    def _guardar(self, clave, df, marca=None):
+        self._entradas[clave] = (df, time.monotonic(), marca)
+        self._entradas.move_to_end(clave)
+        self._versiones[clave] = self._versiones.get(clave, 0) + 1
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def edad(self, clave):
+        """Segundos desde que los datos de la clave se confirmaron contra Google (None si no hay)."""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        return None if entrada is None else time.monotonic() - entrada[1]
+
+    def error(self, clave):
+        """Último error al revalidar la clave (None si la última carga funcionó)."""
+        with self._lock:
+            return self._errores.get(clave)
+
+    def _cargar(self, clave, cargador):
+        """Trae la clave (o la renueva si la marca no cambió). Se llama con el candado de carga tomado."""
+        with self._lock:
+            df = self._vigente(clave)
+        if df is not None:
+            return df
+        try:
+            df, marca = self._renovar_si_no_cambio(clave)
+            if df is None:
+                # La marca se toma antes de descargar: si cambia durante la descarga, se detecta luego
+                if marca is None and self.marca is not None:
+                    marca = self.marca()
+                with self._lock:
+                    generacion = self._escrituras.get(clave, 0)
+                df = cargador()
+                with self._lock:
+                    if self._escrituras.get(clave, 0) == generacion:
+                        self._guardar(clave, df, marca)
+                    elif clave in self._entradas:
+                        # Hubo una escritura local durante la descarga: la entrada en caché ya la incluye
+                        df = self._entradas[clave][0]
+        except Exception as e:
+            with self._lock:
+                self._errores[clave] = e
+            raise
+        with self._lock:
+            self._errores.pop(clave, None)
+        return df
+
+    def _revalidar(self, clave, cargador, carga):
+        """Recarga la clave en un hilo aparte si nadie la está cargando ya."""
+        if not carga.acquire(blocking=False):
+            return
+
+        def revalidar():
+            try:
+                self._cargar(clave, cargador)
+            except Exception as e:
+                logger.warning("No se pudo revalidar %s; se sigue sirviendo la copia anterior: %s", clave, e)
+            finally:
+                carga.release()
+
+        threading.Thread(target=revalidar, name="revalidar-cache", daemon=True).start()
+
+    def consultar(self, clave, cargador):
+        """
+        Como `obtener`, pero devuelve `(df, version)` sin copiar: el DataFrame
+        es el de la caché y no debe modificarse.
+        """
+        with self._lock:
+            df = self._vigente(clave)
+            if df is not None:
+                return df, self._versiones.get(clave, 0)
+            entrada = self._entradas.get(clave)
+            carga = self._cargas.setdefault(clave, threading.Lock())
+
+        if entrada is not None and self.revalidar_en_segundo_plano:
+            self._revalidar(clave, cargador, carga)
+            with self._lock:
+                return self._entradas.get(clave, entrada)[0], self._versiones.get(clave, 0)
+
+        with carga:
+            df = self._cargar(clave, cargador)
+            with self._lock:
+                return df, self._versiones.get(clave, 0)
+
+    def pendientes(self, claves):
+        """
+        Claves sin datos vigentes; las vencidas cuya marca no cambió se renuevan aquí.
+
+        :return: (claves a descargar, marca de modificación tomada antes de descargar)
+        """
+        faltan, marca = [], None
+        for clave in claves:
+            with self._lock:
+                if self._vigente(clave) is not None:
+                    continue
+            df, marca_clave = self._renovar_si_no_cambio(clave)
+            if df is None:
+                faltan.append(clave)
+                marca = marca_clave if marca_clave is not None else marca
+        if faltan and marca is None and self.marca is not None:
+            marca = self.marca()
+        return faltan, marca
+
+    def cargar_lote(self, claves, cargador_lote):
+        """
+        Carga juntas las claves sin datos vigentes. Mientras tanto bloquea la
+        carga individual de esas claves, así otras sesiones esperan el lote.
+
+        :param cargador_lote: función(claves faltantes, marca) -> dict clave -> DataFrame
+            (puede devolver solo algunas, o ninguna, para dejarlas a la carga normal)
+        """
+        with self._lock:
+            cargas = [self._cargas.setdefault(c, threading.Lock()) for c in sorted(set(claves))]
+        with ExitStack() as pila:
+            for carga in cargas:
+                pila.enter_context(carga)
+            faltan, marca = self.pendientes(claves)
+            with self._lock:
+                generaciones = {c: self._escrituras.get(c, 0) for c in faltan}
+            datos = cargador_lote(faltan, marca)
+            with self._lock:
+                for clave, df in datos.items():
+                    if self._escrituras.get(clave, 0) == generaciones.get(clave, 0):
+                        self._guardar(clave, df, marca)
+
+    def obtener(self, clave, cargador):
+        """
+        Devuelve una copia de los datos en caché o los carga con `cargador`.
+
+        :param clave: nombre de la hoja
+        :param cargador: función sin argumentos que devuelve un DataFrame
+        """
+        return self.consultar(clave, cargador)[0].copy()
+
+    def agregar_filas(self, clave, filas):
+        """
+        Escritura directa: añade filas a los datos en caché tras una escritura
+        exitosa, para que las lecturas siguientes ya las incluyan.
+        """
+        with self._lock:
+            self._escrituras[clave] = self._escrituras.get(clave, 0) + 1
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return
+            df = concatenar_tipado(entrada[0], filas, ESQUEMAS_HOJAS.get(clave, {}))
+            # La escritura cambia la marca del archivo; se conserva la anterior para no confundirlas
+            self._entradas[clave] = (df, entrada[1], entrada[2])
+            self._versiones[clave] = self._versiones.get(clave, 0) + 1
+
+    def invalidar(self, clave=None):
+        """Descarta la entrada de una hoja (o todas) para forzar la recarga."""
+        with self._lock:
+            claves = [clave] if clave is not None else list(self._entradas)
+            for c in claves:
+                self._escrituras[c] = self._escrituras.get(c, 0) + 1
+                if self._entradas.pop(c, None) is not None:
+                    self._versiones[c] = self._versiones.get(c, 0) + 1
+
+
+@st.cache_resource(show_spinner=False)
+def _cache_compartida(spreadsheet_id, _conexion):
+    return CacheHojas(marca=_conexion.marca_modificacion)
+
+
+def obtener_cache(secrets):
+    """Devuelve la caché de hojas compartida del proceso."""
+    return _cache_compartida(secrets["spreadsheet"]["id"], obtener_conexion(secrets))
+
+
+COLUMNAS_SQL_VOTOS = [
+    "fecha", "rol_votante", "correo", "id_equipo", "puntaje_total", "criterio_1", "criterio_2", "criterio_3",
+    "id_voto"
+]
+
+
+def abrir_sqlite(ruta):
+    """Abre una base SQLite local en modo WAL, compartible entre hilos y procesos."""
+    db = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=FULL")
+    return db
+
+
+class DiarioVotos:
+    """
+    Tabla local de votos (SQLite en modo WAL) con envío diferido a Sheets.
+
+    Cada voto se guarda primero en disco y se confirma al usuario de
+    inmediato. Si hay `conexion`, un hilo en segundo plano lo envía después a
+    la hoja "Votaciones" en lotes con `append_rows`, reintentando con espera
+    exponencial si la API falla. Sin `conexion` la tabla es solo local.
+
+    Para no duplicar filas, cada voto lleva su `Id_voto` (columna I) y un
+    lote se marca "en envío" antes de llamar a la API. Si el resultado de un
+    envío es incierto (timeout, error), antes de reintentarlo se leen los
+    Id_voto ya presentes en la hoja y solo se reenvían los que faltan.
+
+    Con `compartido` (ver `EstadoCompartido`), si varios procesos usan el
+    mismo archivo solo envía el que tiene el arriendo del diario. El arriendo
+    se renueva antes de cada lote y dura `vigencia_arriendo` segundos, más que
+    el peor caso de una escritura con sus reintentos (6 intentos de hasta 35 s
+    más ~31 s de pausas): así no vence mientras un `append_rows` sigue en
+    curso y otro proceso no reenvía ese mismo lote.
+    """
+
+    PENDIENTE, EN_ENVIO, ENVIADO = 0, 1, 2
+
+    def __init__(self, ruta, conexion=None, tamano_lote=200, intervalo=2.0, espera_maxima=60.0, compartido=None,
+                 vigencia_arriendo=300.0):
+        self.ruta = ruta
+        self.conexion = conexion
+        self.compartido = compartido
+        self.arriendo = f"envio:{os.path.abspath(ruta)}"
+        self.vigencia_arriendo = vigencia_arriendo
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.espera_maxima = espera_maxima
+        self.ultimo_error = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._db = abrir_sqlite(ruta)
+        self._crear_tabla()
+        if conexion is not None:
+            self._hilo = threading.Thread(target=self._bucle, name="envio-votos", daemon=True)
+            self._hilo.start()
+
+    def _crear_tabla(self):
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS votos (
+                orden INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_voto TEXT NOT NULL UNIQUE,
+                fecha TEXT,
+                rol_votante TEXT,
+                correo TEXT,
+                id_equipo TEXT,
+                puntaje_total INTEGER,
+                criterio_1 INTEGER,
+                criterio_2 INTEGER,
+                criterio_3 INTEGER,
+                creado REAL NOT NULL,
+                estado INTEGER NOT NULL DEFAULT 0,
+                intentos INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_votos_estado ON votos (estado, orden)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_votos_correo_equipo ON votos (correo, id_equipo)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_votos_equipo ON votos (id_equipo)")
+
+    def _insertar(self, registro, estado):
+        cursor = self._db.execute(
+            f"INSERT OR IGNORE INTO votos ({', '.join(COLUMNAS_SQL_VOTOS)}, creado, estado) "
+            f"VALUES ({', '.join('?' * len(COLUMNAS_SQL_VOTOS))}, ?, ?)",
+            (*registro, time.time(), estado),
+        )
+        return cursor.rowcount == 1
+
+    def registrar(self, registro):
+        """
+        Guarda un voto en el diario y despierta al hilo de envío.
+
+        :param registro: fila de la hoja Votaciones; el último valor es el Id_voto
+        :return: False si ya existía un voto con ese Id_voto
+        """
+        with self._lock:
+            nuevo = self._insertar(registro, self.PENDIENTE)
+        self._despertar.set()
+        return nuevo
+
+    def importar(self, filas):
+        """Carga votos que ya están en la hoja (quedan marcados como enviados)."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            for fila in filas:
+                self._insertar(fila, self.ENVIADO)
+            self._db.execute("COMMIT")
+
+    def _filas(self, condicion="", parametros=()):
+        with self._lock:
+            return self._db.execute(
+                f"SELECT orden, {', '.join(COLUMNAS_SQL_VOTOS)} FROM votos {condicion} ORDER BY orden",
+                parametros,
+            ).fetchall()
+
+    def pendientes(self):
+        """Filas aún no confirmadas en la hoja, en orden de llegada."""
+        return [list(f[1:]) for f in self._filas("WHERE estado != ?", (self.ENVIADO,))]
+
+    def votos_desde(self, orden):
+        """
+        Votos registrados después de `orden`.
+
+        :return: (filas, último orden leído)
+        """
+        filas = self._filas("WHERE orden > ?", (orden,))
+        return [list(f[1:]) for f in filas], (filas[-1][0] if filas else orden)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM votos").fetchone()[0]
+
+    def _lote(self):
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {', '.join(COLUMNAS_SQL_VOTOS)}, estado FROM votos WHERE estado != ? ORDER BY orden LIMIT ?",
+                (self.ENVIADO, self.tamano_lote),
+            ).fetchall()
+
+    def _marcar(self, ids, estado):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE votos SET estado = ?, intentos = intentos + ? WHERE id_voto = ?",
+                [(estado, int(estado == self.EN_ENVIO), i) for i in ids],
+            )
+
+    def _ids_en_hoja(self):
+        ws_votos = self.conexion.hoja("Votaciones")
+        return set(ws_votos.col_values(COLUMNAS_VOTACIONES.index("Id_voto") + 1))
+
+    def enviar_lote(self):
+        """
+        Envía a Sheets el siguiente lote pendiente.
+
+        :return: número de votos confirmados en la hoja
+        """
+        lote = self._lote()
+        if not lote:
+            return 0
+
+        # Resolver envíos con resultado incierto antes de reintentar
+        if any(fila[-1] == self.EN_ENVIO for fila in lote):
+            presentes = self._ids_en_hoja()
+            ya_enviados = [fila[-2] for fila in lote if fila[-2] in presentes]
+            self._marcar(ya_enviados, self.ENVIADO)
+            lote = [fila for fila in lote if fila[-2] not in presentes]
+            if not lote:
+                return len(ya_enviados)
+
+        ids = [fila[-2] for fila in lote]
+        self._marcar(ids, self.EN_ENVIO)
+        ws_votos = self.conexion.hoja("Votaciones")
+        ws_votos.append_rows([list(fila[:-1]) for fila in lote])
+        self._marcar(ids, self.ENVIADO)
+        return len(ids)
+
+    def _bucle(self):
+        espera = self.intervalo
+        while True:
+            self._despertar.wait(espera)
+            self._despertar.clear()
+            try:
+                # Sin el arriendo (o si se perdió entre lotes) otro proceso es quien envía
+                while self.compartido is None or self.compartido.arriendo(self.arriendo, self.vigencia_arriendo):
+                    if not self.enviar_lote():
+                        break
+                self.ultimo_error = None
+                espera = self.intervalo
+            except Exception as e:
+                self.ultimo_error = e
+                logger.warning("No se pudieron enviar votos a Sheets: %s", e)
+                espera = min(espera * 2, self.espera_maxima) * random.uniform(0.8, 1.2)
+
+
+RUTA_ESTADO_COMPARTIDO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "estado_compartido.db")
+
+
+class EstadoCompartido:
+    """
+    Estado compartido entre los procesos de la app en un mismo servidor (varias
+    réplicas de Streamlit detrás de un proxy), en un archivo SQLite en modo WAL.
+
+    - Arriendos con vencimiento: deciden qué proceso habla con Google (lee una
+      hoja, sondea los votos, envía el diario); los demás usan lo que ese
+      proceso publica. Si el titular se cae, el arriendo vence y otro lo toma.
+    - Hojas publicadas: última lectura de cada hoja (valores, marca de Drive e instante).
+    - Filas de Votaciones publicadas por el proceso que sondea la hoja, numeradas
+      como en la hoja; cada recarga completa abre una generación nueva.
+    - Pares (correo, equipo) que ya votaron y resultados de idempotencia, para
+      que un voto repetido se detecte aunque llegue por otra réplica. Los pares
+      se reconcilian con Votaciones en cada recarga completa (`reconciliar_pares`).
+    """
+
+    def __init__(self, ruta, titular=None):
+        self.ruta = ruta
+        self.titular = titular or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = abrir_sqlite(ruta)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS arriendos (nombre TEXT PRIMARY KEY, titular TEXT NOT NULL, vence REAL NOT NULL)"
+            )
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS hojas (
+                    nombre TEXT PRIMARY KEY, valores TEXT NOT NULL, marca TEXT, publicado REAL NOT NULL
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS votos_hoja (
+                    generacion INTEGER NOT NULL, fila INTEGER NOT NULL, valores TEXT NOT NULL,
+                    PRIMARY KEY (generacion, fila)
+                )
+            """)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS pares_votados (
+                    correo TEXT NOT NULL, id_equipo TEXT NOT NULL, reclamado REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (correo, id_equipo)
+                )
+            """)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotencia (clave TEXT PRIMARY KEY, resultado TEXT NOT NULL, "
+                "guardado REAL NOT NULL)"
+            )
+
+    # ---------- Arriendos ----------
+
+    def arriendo(self, nombre, duracion):
+        """
+        Toma o renueva el arriendo `nombre` por `duracion` segundos.
+
+        :return: True si este proceso es el titular
+        """
+        ahora = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO arriendos (nombre, titular, vence) VALUES (?, ?, ?) "
+                "ON CONFLICT (nombre) DO UPDATE SET titular = excluded.titular, vence = excluded.vence "
+                "WHERE arriendos.vence < ? OR arriendos.titular = excluded.titular",
+                (nombre, self.titular, ahora + duracion, ahora),
+            )
+            return cursor.rowcount == 1
+
+    def soltar(self, nombre):
+        """Libera el arriendo si este proceso es el titular."""
+        with self._lock:
+            self._db.execute("DELETE FROM arriendos WHERE nombre = ? AND titular = ?", (nombre, self.titular))
+
+    # ---------- Hojas ----------
+
+    def publicar_hoja(self, nombre, valores, marca=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO hojas (nombre, valores, marca, publicado) VALUES (?, ?, ?, ?)",
+                (nombre, json.dumps(valores), None if marca is None else json.dumps(marca), time.time()),
+            )
+
+    def hoja(self, nombre):
+        """
+        :return: (valores, marca, segundos desde la publicación), o None si nadie la publicó
+        """
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT valores, marca, publicado FROM hojas WHERE nombre = ?", (nombre,)
+            ).fetchone()
+        if fila is None:
+            return None
+        marca = None if fila[1] is None else tuple(json.loads(fila[1]))
+        return json.loads(fila[0]), marca, time.time() - fila[2]
+
+    # ---------- Votaciones ----------
+
+    def estado_votos(self):
+        """:return: (generación vigente o 0 si no hay, número de la última fila publicada)"""
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT generacion, MAX(fila) FROM votos_hoja WHERE generacion = (SELECT MAX(generacion) FROM votos_hoja)"
+            ).fetchone()
+        return (fila[0], fila[1]) if fila[0] is not None else (0, 0)
+
+    def publicar_votos(self, encabezados, filas, desde=None):
+        """
+        Publica filas de Votaciones. Con `desde=None` abre una generación nueva
+        con los encabezados y todas las filas; si no, agrega `filas` a partir
+        de la fila `desde` de la generación vigente.
+
+        :return: (generación, número de la última fila publicada)
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                generacion = self._db.execute("SELECT COALESCE(MAX(generacion), 0) FROM votos_hoja").fetchone()[0]
+                if desde is None:
+                    generacion += 1
+                    filas = [encabezados] + list(filas)
+                    desde = 1
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO votos_hoja (generacion, fila, valores) VALUES (?, ?, ?)",
+                    [(generacion, desde + i, json.dumps(f)) for i, f in enumerate(filas)],
+                )
+                self._db.execute("DELETE FROM votos_hoja WHERE generacion < ?", (generacion,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return generacion, desde + len(filas) - 1
+
+    def votos_desde(self, generacion, fila):
+        """
+        Filas publicadas después de `fila` en la generación indicada. Si la
+        generación vigente es otra, devuelve la generación completa.
+
+        :return: (generación vigente, encabezados o None, filas nuevas, número de la última fila)
+        """
+        with self._lock:
+            vigente = self._db.execute("SELECT COALESCE(MAX(generacion), 0) FROM votos_hoja").fetchone()[0]
+            if vigente != generacion:
+                fila = 0
+            datos = self._db.execute(
+                "SELECT fila, valores FROM votos_hoja WHERE generacion = ? AND fila > ? ORDER BY fila",
+                (vigente, fila),
+            ).fetchall()
+        filas = [json.loads(v) for _, v in datos]
+        ultima = datos[-1][0] if datos else fila
+        if vigente != generacion and filas:
+            return vigente, filas[0], filas[1:], ultima
+        return vigente, None, filas, ultima
+
+    # ---------- Votos repetidos ----------
+
+    def reclamar_par(self, correo, equipo_id):
+        """
+        Marca el par (correo normalizado, equipo) como votado en todas las réplicas.
+
+        :return: False si ya estaba marcado
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO pares_votados (correo, id_equipo, reclamado) VALUES (?, ?, ?)",
+                (correo, equipo_id, time.time()),
+            )
+            return cursor.rowcount == 1
+
+    def reconciliar_pares(self, pares, margen):
+        """
+        Deja marcados solo los pares presentes en `pares` (los de Votaciones y el
+        diario) y los reclamados hace menos de `margen` segundos, que pueden no
+        haber llegado aún a la hoja. Así un voto borrado de la hoja, o una hoja
+        nueva que reutiliza códigos de equipo, no bloquea a nadie para siempre.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM pares_votados WHERE reclamado < ?", (time.time() - margen,))
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO pares_votados (correo, id_equipo, reclamado) VALUES (?, ?, 0)", pares
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def liberar_par(self, correo, equipo_id):
+        with self._lock:
+            self._db.execute("DELETE FROM pares_votados WHERE correo = ? AND id_equipo = ?", (correo, equipo_id))
+
+    def par_votado(self, correo, equipo_id):
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM pares_votados WHERE correo = ? AND id_equipo = ?", (correo, equipo_id)
+            ).fetchone() is not None
+
+    def resultado(self, clave, vigencia):
+        """Resultado guardado para la clave de idempotencia (None si no hay o venció)."""
+        with self._lock:
+            fila = self._db.execute(
+                "SELECT resultado FROM idempotencia WHERE clave = ? AND guardado >= ?", (clave, time.time() - vigencia)
+            ).fetchone()
+        return None if fila is None else json.loads(fila[0])
+
+    def guardar_resultado(self, clave, resultado, vigencia):
+        ahora = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO idempotencia (clave, resultado, guardado) VALUES (?, ?, ?)",
+                (clave, json.dumps(resultado), ahora),
+            )
+            self._db.execute("DELETE FROM idempotencia WHERE guardado < ?", (ahora - vigencia,))
+
+
+@st.cache_resource(show_spinner=False)
+def _estado_compartido(ruta):
+    return EstadoCompartido(ruta)
+
+
+def obtener_estado_compartido(secrets):
+    """
+    Estado compartido entre réplicas, según `[compartido]` en secrets (activo
+    por defecto, en `estado_compartido.db` junto a la app).
+
+    :return: EstadoCompartido, o None si se desactivó con `activo = false`
+    """
+    config = secrets.get("compartido", {})
+    if not config.get("activo", True):
+        return None
+    return _estado_compartido(config.get("ruta", RUTA_ESTADO_COMPARTIDO))
+
+
 def conectar_google_sheets(secrets, hoja_nombre=None):
     """
-    Conecta a Google Sheets y devuelve un DataFrame.
+    Conecta a Google Sheets y devuelve un DataFrame.
+
+    :param secrets: credenciales de GCP desde st.secrets
+    :param hoja_nombre: nombre de la hoja específica a leer (opcional)
+    :return: pd.DataFrame con los datos de la hoja
+    """
+    def leer():
+        worksheet = obtener_conexion(secrets).hoja(hoja_nombre)
+        return hoja_tipada(hoja_nombre, worksheet.get_all_values())
+
+    return obtener_cache(secrets).obtener(hoja_nombre, leer)
+
+def contar_participantes(participantes_str):
+    if not participantes_str:
+        return 0
+    estudiantes = [p.strip() for p in participantes_str.split(',') if p.strip()]
+    return len(estudiantes)
+
+
+def _columna_fecha(serie):
+    fechas = pd.to_datetime(serie, errors="coerce", format="ISO8601")
+    # Sheets puede devolver la fecha con el formato regional (p. ej. 31/10/2025 18:05:00)
+    fallidas = fechas.isna() & serie.astype(str).str.strip().ne("") & serie.notna()
+    if fallidas.any():
+        fechas[fallidas] = pd.to_datetime(serie[fallidas], errors="coerce", format="mixed", dayfirst=True)
+    return fechas
+
+
+def _columna_entera(serie, dtype):
+    numeros = pd.to_numeric(serie, errors="coerce")
+    if numeros.isna().any() or not (numeros % 1 == 0).all():
+        return numeros.astype("float32")
+    return numeros.astype(dtype)
+
+
+def tipar_columnas(df, esquema):
+    """
+    Convierte en bloque las columnas de `df` a los tipos declarados en `esquema`:
+    "categoria" (category), "entero8"/"entero16" (int8/int16, o float32 si hay
+    vacíos o decimales), "fecha" (datetime64, NaT si no se entiende) y "texto".
+
+    :return: el mismo DataFrame, con las columnas convertidas
+    """
+    for columna, tipo in esquema.items():
+        if columna not in df.columns:
+            continue
+        serie = df[columna]
+        if tipo == "categoria":
+            df[columna] = serie.astype("category")
+        elif tipo == "entero8":
+            df[columna] = _columna_entera(serie, "int8")
+        elif tipo == "entero16":
+            df[columna] = _columna_entera(serie, "int16")
+        elif tipo == "fecha":
+            df[columna] = _columna_fecha(serie)
+        else:
+            df[columna] = serie.where(serie.notna(), "").astype(str)
+    return df
+
+
+def concatenar_tipado(df, filas, esquema):
+    """
+    Añade `filas` a un DataFrame ya tipado sin perder los tipos: las filas se
+    tipan con el mismo `esquema` y las categorías de ambos lados se unen antes
+    de concatenar (si no, pandas cae a object).
+
+    :return: DataFrame nuevo; `df` no se modifica
+    """
+    nuevas = tipar_columnas(pd.DataFrame(filas), esquema)
+    df = df.copy(deep=False)
+    for columna, tipo in esquema.items():
+        if tipo != "categoria" or columna not in df.columns or columna not in nuevas.columns:
+            continue
+        if not isinstance(df[columna].dtype, pd.CategoricalDtype):
+            continue
+        categorias = df[columna].cat.categories.union(nuevas[columna].cat.categories)
+        df[columna] = df[columna].cat.set_categories(categorias)
+        nuevas[columna] = nuevas[columna].cat.set_categories(categorias)
+    return pd.concat([df, nuevas], ignore_index=True)
+
+
+def dataframe_desde_valores(valores, esquema=None):
+    """
+    Arma un DataFrame por columnas a partir de las filas de `get_all_values`
+    (primera fila = encabezados), sin crear un dict por fila. Las filas se
+    completan al ancho de los encabezados y las columnas del esquema se tipan.
+    """
+    if not valores:
+        return pd.DataFrame()
+    encabezados, *filas = valores
+    ancho = len(encabezados)
+    columnas = list(zip(*[(list(f) + [""] * ancho)[:ancho] for f in filas])) or [()] * ancho
+    df = pd.DataFrame({i: pd.Series(columna, dtype=object) for i, columna in enumerate(columnas)})
+    df.columns = [str(c) for c in encabezados]
+    return tipar_columnas(df, esquema or {})
+
+
+def hoja_tipada(nombre, valores):
+    """
+    DataFrame tipado de una hoja según `ESQUEMAS_HOJAS` (las inscripciones se
+    normalizan antes de tipar).
+    """
+    df = dataframe_desde_valores(valores)
+    if nombre == "Respuestas de formulario 1":
+        df = normalizar_inscripciones(df)
+    return tipar_columnas(df, ESQUEMAS_HOJAS.get(nombre, {}))
+
+
+def votos_dataframe(filas):
+    """DataFrame tipado de votos a partir de filas en el orden de `COLUMNAS_VOTACIONES`."""
+    return tipar_columnas(pd.DataFrame(filas, columns=COLUMNAS_VOTACIONES), ESQUEMAS_HOJAS["Votaciones"])
+
+
+def en_lotes(filas, tamano_lote):
+    """Agrupa un iterable de filas en listas de hasta `tamano_lote` filas."""
+    filas = iter(filas)
+    while lote := list(itertools.islice(filas, tamano_lote)):
+        yield lote
+
+
+def contar_participantes_serie(participantes):
+    """
+    Versión vectorizada de `contar_participantes`: cuenta los nombres no
+    vacíos separados por coma en cada celda de la serie.
+    """
+    return participantes.fillna("").astype(str).str.count(r"[^,]*[^,\s][^,]*").astype(int)
+
+
+def normalizar_inscripciones(df):
+    """
+    Limpia y renombra las columnas de 'Respuestas de formulario 1'
+    para que coincidan con el dashboard.
+    """
+    # Limpiar nombres de columna
+    df.columns = df.columns.str.strip()
+
+    # Renombrar columnas para que coincidan con el dashboard
+    df.rename(columns={
+        'Inscripción Participantes': 'Participantes',
+        'Id_equipo (Respuestas de formulario 1)': 'Id_equipo',
+        'Nombre del Equipo': 'Equipo'
+    }, inplace=True)
+
+    return df
+
+
+class LectorIncremental:
+    """
+    Lector incremental de una hoja de solo-anexar (p. ej. "Votaciones").
+
+    Recuerda la última fila consumida `n` y en cada actualización pide solo el
+    rango `A{n}:<col>`: la fila `n` se vuelve a leer como testigo y el resto
+    son filas nuevas. Para notar ediciones en filas anteriores, en la misma
+    llamada se relee un bloque de `muestra_verificacion` filas ya consumidas
+    que rota por toda la hoja; y si la marca de Drive cambió pero no llegaron
+    filas nuevas, el cambio no fue un anexo (se editó esta u otra hoja del
+    archivo). La marca solo sirve de prueba si la lectura anterior tampoco
+    trajo filas: si trajo, pudo haberse anexado algo entre la consulta de la
+    marca y la del tramo. En cualquiera de esos casos (o si
+    la fila testigo cambió o desapareció, o pasó `recarga_completa` segundos
+    desde la última descarga total) se recarga la hoja completa.
+
+    Antes de pedir el tramo se compara la marca de modificación del archivo
+    en Drive: si no cambió desde la última lectura, no se consulta la hoja
+    (como máximo durante `verificacion_maxima` segundos seguidos).
+
+    Los suscriptores reciben un DataFrame con las filas nuevas (o todas, si
+    hubo recarga) y un booleano que indica si fue recarga completa, siempre en
+    el orden en que se leyeron: una recarga no puede llegar después de un
+    delta leído más tarde y borrarlo.
+    """
+
+    def __init__(self, conexion, nombre_hoja, columnas, recarga_completa=300, verificacion_maxima=60, esquema=None,
+                 muestra_verificacion=200):
+        self.conexion = conexion
+        self.nombre_hoja = nombre_hoja
+        self.columnas_por_defecto = list(columnas)
+        self.esquema = esquema or {}
+        self.recarga_completa = recarga_completa
+        self.verificacion_maxima = verificacion_maxima
+        self.muestra_verificacion = muestra_verificacion
+        self.columna_final = gspread.utils.rowcol_to_a1(1, len(columnas))[:-1]
+        self._lock = threading.Lock()
+        # Se toma dentro de `_lock` y se suelta al terminar de entregar: fija el orden de las entregas
+        self._lock_entrega = threading.Lock()
+        self._suscriptores = []
+        self.encabezados = None
+        self.filas = []
+        self._cargado_en = 0.0
+        self._leido_en = 0.0
+        self._consultado_en = 0.0
+        self._marca = None
+        self._marca_explicada = False  # la marca guardada corresponde a todo lo leído
+        self._proxima_muestra = 0  # índice en `filas` del próximo bloque a verificar
+
+    @property
+    def ultima_fila(self):
+        """Número de fila en la hoja de la última fila consumida (1 = encabezados)."""
+        return len(self.filas) + 1
+
+    def suscribir(self, funcion):
+        with self._lock:
+            self._suscriptores.append(funcion)
+
+    def _normalizar(self, fila):
+        fila = list(fila[:len(self.encabezados)])
+        return fila + [""] * (len(self.encabezados) - len(fila))
+
+    @property
+    def cargado(self):
+        return self.encabezados is not None
+
+    @property
+    def rango_completo(self):
+        """Rango A1 de la hoja completa (solo las columnas esperadas)."""
+        return self._rango(1)
+
+    def _rango(self, desde, hasta=None):
+        """Rango A1 de las filas `desde`..`hasta` de la hoja (hasta el final si es None)."""
+        return gspread.utils.absolute_range_name(
+            self.nombre_hoja, f"A{desde}:{self.columna_final}{'' if hasta is None else hasta}"
+        )
+
+    def _bloque_muestra(self):
+        """
+        Próximo bloque de filas ya consumidas a verificar (sin la fila testigo).
+
+        :return: (índice inicial, índice final exclusivo) en `filas`
+        """
+        total = len(self.filas) - 1
+        if total <= 0:
+            return 0, 0
+        if self._proxima_muestra >= total:
+            self._proxima_muestra = 0
+        desde = self._proxima_muestra
+        hasta = min(desde + self.muestra_verificacion, total)
+        self._proxima_muestra = hasta
+        return desde, hasta
+
+    def _muestra_coincide(self, muestra, desde, hasta):
+        # La API omite las filas vacías al final de un rango: se completan antes de comparar
+        esperadas = self.filas[desde:hasta]
+        if len(muestra) > len(esperadas):
+            return False
+        leidas = [self._normalizar(f) for f in muestra]
+        leidas += [self._normalizar([])] * (len(esperadas) - len(leidas))
+        return leidas == esperadas
+
+    def iniciar(self, valores, marca=None, reemplazar=False):
+        """
+        Carga inicial con valores ya descargados (p. ej. en lote junto con
+        otras hojas). No hace nada si el lector ya estaba cargado, salvo con
+        `reemplazar` (p. ej. otra réplica publicó una recarga completa).
+        """
+        with self._lock:
+            if self.cargado and not reemplazar:
+                return
+            filas = self._cargar_valores(valores)
+            self._marca = marca
+            self._consultado_en = self._leido_en = time.monotonic()
+            self._lock_entrega.acquire()
+        self._entregar(filas, True)
+
+    def agregar(self, filas):
+        """Incorpora filas nuevas leídas por otro proceso y las publica a los suscriptores."""
+        with self._lock:
+            nuevas = [self._normalizar(f) for f in filas]
+            if not nuevas:
+                return nuevas
+            self.filas.extend(nuevas)
+            self._lock_entrega.acquire()
+        self._entregar(nuevas, False)
+        return nuevas
+
+    def _entregar(self, filas, recargado):
+        """
+        Publica `filas` a los suscriptores. Se llama con `_lock_entrega` ya tomado
+        (antes de soltar `_lock`) y lo libera al terminar.
+        """
+        try:
+            df = self._dataframe(filas)
+            for funcion in list(self._suscriptores):
+                funcion(df, recargado)
+        finally:
+            self._lock_entrega.release()
+
+    def _recargar(self, ws):
+        return self._cargar_valores(ws.get_all_values())
+
+    def _cargar_valores(self, valores):
+        encabezados = [str(c).strip() for c in (valores[0] if valores else [])]
+        # Solo se leen las columnas esperadas; los encabezados vacíos toman el nombre por defecto
+        self.encabezados = [
+            (encabezados[i] if i < len(encabezados) else "") or nombre
+            for i, nombre in enumerate(self.columnas_por_defecto)
+        ]
+        self.filas = [self._normalizar(f) for f in valores[1:]]
+        self._cargado_en = time.monotonic()
+        self._proxima_muestra = 0
+        self._marca_explicada = False
+        return self.filas
+
+    def actualizar(self, intervalo_minimo=0):
+        """
+        Trae las filas nuevas de la hoja.
+
+        :param intervalo_minimo: si la última lectura es más reciente que esto
+            (segundos), no se consulta la hoja
+        :return: (filas nuevas, True si hubo recarga completa)
+        """
+        with self._lock:
+            if time.monotonic() - self._leido_en < intervalo_minimo:
+                return [], False
+            self._leido_en = time.monotonic()
+            vencida = time.monotonic() - self._cargado_en > self.recarga_completa
+            marca = self.conexion.marca_modificacion()
+            sin_cambios = (
+                marca is not None and marca == self._marca
+                and time.monotonic() - self._consultado_en < self.verificacion_maxima
+            )
+            if self.encabezados is not None and not vencida and sin_cambios:
+                return [], False
+            ws = self.conexion.hoja(self.nombre_hoja)
+            if self.encabezados is None or vencida:
+                nuevas, recargado = self._recargar(ws), True
+            else:
+                # Tramo nuevo (con la fila testigo) y bloque de verificación en una sola llamada
+                n = self.ultima_fila
+                desde, hasta = self._bloque_muestra()
+                rangos = [self._rango(n)] + ([self._rango(desde + 2, hasta + 1)] if hasta > desde else [])
+                tramo, *muestra = self.conexion.leer_rangos(rangos)
+                testigo = self.filas[-1] if self.filas else self.encabezados
+                editada = (
+                    not tramo or self._normalizar(tramo[0]) != testigo
+                    or (muestra and not self._muestra_coincide(muestra[0], desde, hasta))
+                    # La marca cambió sin filas nuevas: no fue un anexo
+                    or (self._marca_explicada and marca is not None and marca != self._marca and len(tramo) < 2)
+                )
+                if editada:
+                    nuevas, recargado = self._recargar(ws), True
+                else:
+                    nuevas = [self._normalizar(f) for f in tramo[1:]]
+                    self.filas.extend(nuevas)
+                    recargado = False
+            self._marca = marca
+            self._marca_explicada = not (nuevas or recargado)
+            self._consultado_en = time.monotonic()
+            if nuevas or recargado:
+                self._lock_entrega.acquire()
+
+        if nuevas or recargado:
+            self._entregar(nuevas, recargado)
+        return nuevas, recargado
+
+    @staticmethod
+    def con_datos(fila):
+        """False para las filas en blanco que deja la hoja (se ignoran al leer y al exportar)."""
+        return any(str(v).strip() for v in fila)
+
+    def _dataframe(self, filas):
+        filas = [f for f in filas if self.con_datos(f)]
+        # Sin carga todavía (p. ej. Google no respondió) se devuelve un DataFrame vacío con las columnas esperadas
+        return dataframe_desde_valores([self.encabezados or self.columnas_por_defecto] + filas, self.esquema)
+
+    def dataframe(self):
+        """Todas las filas consumidas hasta ahora como DataFrame."""
+        with self._lock:
+            return self._dataframe(list(self.filas))
+
+
+# ======================================================
+# 🔹 ALMACENAMIENTO
+# ======================================================
+
+RUTA_BASE_LOCAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "concurso.db")
+
+
+class RepositorioConcurso(ABC):
+    """
+    Interfaz de almacenamiento del concurso: inscripciones, docentes y votos.
+
+    Los DataFrames usan los nombres de columna de las hojas de Google
+    (`COLUMNAS_VOTACIONES` para votos; Docente, Participantes, Id_equipo y
+    Equipo para inscripciones; Correo y Codigo para docentes).
+    Los suscriptores reciben los votos nuevos como `(df_nuevos, recargado)`.
+    """
+
+    def __init__(self):
+        self._suscriptores = []
+
+    def suscribir(self, funcion):
+        self._suscriptores.append(funcion)
+
+    def _publicar(self, df_nuevos, recargado):
+        for funcion in list(self._suscriptores):
+            funcion(df_nuevos, recargado)
+
+    @abstractmethod
+    def cargar_inscripciones(self):
+        """Inscripciones (Docente, Participantes, Id_equipo, Equipo) como DataFrame."""
+
+    @abstractmethod
+    def version_inscripciones(self):
+        """Número que cambia cuando pueden haber cambiado las inscripciones (barato de consultar)."""
+
+    @abstractmethod
+    def cargar_docentes(self, fresco=False):
+        """
+        Docentes (Correo, Codigo) como DataFrame.
+
+        :param fresco: consultar el origen (Google) en vez de servir una copia guardada
+        """
+
+    @abstractmethod
+    def cargar_votos(self):
+        """Todos los votos como DataFrame con `COLUMNAS_VOTACIONES`."""
+
+    @abstractmethod
+    def votos_conocidos(self):
+        """Votos ya leídos o aceptados por este proceso, sin consultar el origen."""
+
+    @abstractmethod
+    def leer_votos_nuevos(self, intervalo_minimo=0):
+        """Trae los votos nuevos y los publica a los suscriptores."""
+
+    @abstractmethod
+    def registrar_voto(self, registro):
+        """
+        Guarda un voto (fila en el orden de `COLUMNAS_VOTACIONES`).
+
+        :return: False si ya existía un voto con ese Id_voto
+        """
+
+    def votos_pendientes(self):
+        """Votos aceptados que todavía no aparecen en `leer_votos_nuevos`."""
+        return []
+
+    @abstractmethod
+    def iterar_inscripciones(self, docente=None, equipo=None, tamano_lote=5000):
+        """
+        Inscripciones en lotes de filas (en el orden de `COLUMNAS_INSCRIPCIONES`),
+        filtradas al leer, para exportarlas sin armar un DataFrame completo.
+        """
+
+    @abstractmethod
+    def iterar_votos(self, docente=None, equipo=None, tamano_lote=5000):
+        """
+        Votos en lotes de filas (en el orden de `COLUMNAS_VOTACIONES`), filtrados
+        al leer por equipo o por los equipos de un docente.
+        """
+
+    def precargar(self, nombres):
+        """Trae juntas las hojas que una pantalla va a necesitar (si aplica al almacenamiento)."""
+
+    def estado_datos(self, hoja):
+        """
+        Qué tan actuales son los datos de una hoja copiados de Google.
+
+        :return: (segundos desde la última lectura confirmada o None, último error o None)
+        """
+        return None, None
+
+
+class RepositorioSheets(RepositorioConcurso):
+    """
+    Almacenamiento en Google Sheets: lecturas con caché por hoja, votos por el
+    diario local con envío diferido y lectura incremental de "Votaciones".
+
+    Con `compartido` (varias réplicas en el mismo servidor), una sola réplica
+    lee cada hoja por TTL y publica los valores; las demás usan lo publicado.
+    Igual con "Votaciones": sondea la hoja solo el titular del arriendo del
+    sondeo, y las demás siguen las filas que él publica.
+    """
+
+    ARRIENDO_SONDEO = "sondeo-votaciones"
+
+    def __init__(self, conexion, cache, diario, compartido=None, vigencia_sondeo=30, espera_publicacion=10):
+        super().__init__()
+        self.conexion = conexion
+        self.cache = cache
+        self.diario = diario
+        self.compartido = compartido
+        self.vigencia_sondeo = vigencia_sondeo
+        self.espera_publicacion = espera_publicacion
+        self.lector = LectorIncremental(
+            conexion, "Votaciones", COLUMNAS_VOTACIONES, esquema=ESQUEMAS_HOJAS["Votaciones"]
+        )
+        self.lector.suscribir(self._publicar)
+        self._lock_precarga = threading.Lock()
+        self._lock_votos = threading.RLock()
+        self._generacion_votos = 0
+        self._fila_votos = 0
+
+    # Hojas que se leen completas a la caché
+    HOJAS_EN_CACHE = ("Respuestas de formulario 1", "Docentes")
+
+    def _sirve_publicada(self, nombre, publicada, marca, fresco=False):
+        """
+        True si la copia publicada (ver `EstadoCompartido.hoja`) sirve para esta
+        lectura: con la misma marca de Drive si se conoce la actual, o dentro del
+        TTL si no (salvo con `fresco`, que sin marca nunca usa lo publicado).
+        """
+        if publicada is None:
+            return False
+        _, marca_publicada, edad = publicada
+        if marca is not None:
+            return marca == marca_publicada
+        return not fresco and edad < self.cache.ttl(nombre)
+
+    def _publicada_vigente(self, nombre, marca, fresco=False):
+        """Valores publicados por alguna réplica que sirven para esta lectura, o None."""
+        publicada = self.compartido.hoja(nombre)
+        return publicada[0] if self._sirve_publicada(nombre, publicada, marca, fresco) else None
+
+    def _valores_hoja(self, nombre, fresco=False):
+        if self.compartido is None:
+            return self.conexion.hoja(nombre).get_all_values()
+        marca = self.conexion.marca_modificacion()
+        descartada = self.compartido.hoja(nombre)
+        if self._sirve_publicada(nombre, descartada, marca, fresco):
+            return descartada[0]
+        arriendo = f"hoja:{nombre}"
+        if not self.compartido.arriendo(arriendo, self.espera_publicacion * 3):
+            # Otra réplica la está descargando: se espera una publicación posterior a la descartada
+            # (la fecha se reconstruye a partir de la edad; 1 ms de margen)
+            descartada_en = None if descartada is None else time.time() - descartada[2]
+            limite = time.monotonic() + self.espera_publicacion
+            while time.monotonic() < limite:
+                time.sleep(0.25)
+                publicada = self.compartido.hoja(nombre)
+                if publicada is not None and (
+                    descartada_en is None or time.time() - publicada[2] > descartada_en + 1e-3
+                ):
+                    return publicada[0]
+        try:
+            # Otra réplica pudo publicarla entre la primera consulta y el arriendo
+            valores = self._publicada_vigente(nombre, marca, fresco)
+            if valores is None:
+                valores = self.conexion.hoja(nombre).get_all_values()
+                self.compartido.publicar_hoja(nombre, valores, marca)
+        finally:
+            self.compartido.soltar(arriendo)
+        return valores
+
+    def _leer_hoja(self, nombre, fresco=False):
+        return hoja_tipada(nombre, self._valores_hoja(nombre, fresco))
+
+    def _leer_inscripciones(self):
+        return self._leer_hoja("Respuestas de formulario 1")
+
+    def cargar_inscripciones(self):
+        return self.cache.obtener("Respuestas de formulario 1", self._leer_inscripciones)
+
+    def version_inscripciones(self):
+        # Recarga la hoja si venció su TTL; la versión cambia con cada recarga
+        return self.cache.consultar("Respuestas de formulario 1", self._leer_inscripciones)[1]
+
+    def cargar_docentes(self, fresco=False):
+        if fresco:
+            # Sin pasar por la copia en caché (que se serviría vencida mientras se revalida)
+            self.cache.invalidar("Docentes")
+        return self.cache.obtener("Docentes", lambda: self._leer_hoja("Docentes", fresco))
+
+    def _publicar_votos(self, nuevas, recargado):
+        """El titular del sondeo publica lo que leyó; si las réplicas quedaron desfasadas, republica todo."""
+        generacion, ultima = self.compartido.estado_votos()
+        if recargado or generacion != self._generacion_votos or ultima != self.lector.ultima_fila - len(nuevas):
+            self._generacion_votos, self._fila_votos = self.compartido.publicar_votos(
+                self.lector.encabezados, self.lector.filas
+            )
+        elif nuevas:
+            self._generacion_votos, self._fila_votos = self.compartido.publicar_votos(None, nuevas, ultima + 1)
+
+    def _seguir_votos(self):
+        """Incorpora al lector las filas publicadas por el titular del sondeo."""
+        generacion, encabezados, filas, ultima = self.compartido.votos_desde(self._generacion_votos, self._fila_votos)
+        if generacion == 0:
+            return None
+        recargado = encabezados is not None
+        self._generacion_votos, self._fila_votos = generacion, ultima
+        if recargado:
+            self.lector.iniciar([encabezados] + filas, reemplazar=True)
+            return filas, True
+        return self.lector.agregar(filas), False
+
+    def _actualizar_votos(self, intervalo_minimo=0):
+        if self.compartido is None:
+            return self.lector.actualizar(intervalo_minimo)
+        with self._lock_votos:
+            if not self.compartido.arriendo(self.ARRIENDO_SONDEO, self.vigencia_sondeo):
+                resultado = self._seguir_votos()
+                if resultado is not None:
+                    return resultado
+                # Nadie publicó todavía: se lee la hoja sin publicar
+                return self.lector.actualizar(intervalo_minimo)
+            if self.lector.cargado and self._generacion_votos == 0:
+                # Recién pasó a ser titular sin haber seguido a nadie: se alinea con lo publicado
+                self._seguir_votos()
+            nuevas, recargado = self.lector.actualizar(intervalo_minimo)
+            self._publicar_votos(nuevas, recargado)
+            return nuevas, recargado
+
+    def cargar_votos(self):
+        def leer():
+            self._actualizar_votos()
+            return self.votos_conocidos()
+
+        return self.cache.obtener("Votaciones", leer)
+
+    def votos_conocidos(self):
+        df = self.lector.dataframe()
+        en_hoja = set(df["Id_voto"].astype(str)) if "Id_voto" in df.columns else set()
+        pendientes = [fila for fila in self.diario.pendientes() if fila[-1] not in en_hoja]
+        if pendientes:
+            df = tipar_columnas(pd.concat([df, votos_dataframe(pendientes)], ignore_index=True),
+                                ESQUEMAS_HOJAS["Votaciones"])
+        return df
+
+    def leer_votos_nuevos(self, intervalo_minimo=0):
+        return self._actualizar_votos(intervalo_minimo)
+
+    def registrar_voto(self, registro):
+        if not self.diario.registrar(registro):
+            return False
+        fila_voto = dict(zip(COLUMNAS_VOTACIONES, registro))
+        self.cache.agregar_filas("Votaciones", [fila_voto])
+        self._publicar(votos_dataframe([registro]), False)
+        return True
+
+    def votos_pendientes(self):
+        return self.diario.pendientes()
+
+    def iterar_inscripciones(self, docente=None, equipo=None, tamano_lote=5000):
+        # La hoja ya está en la caché del proceso: se filtra y se recorre por tramos
+        df = self.cargar_inscripciones()
+        columnas = [c for c in COLUMNAS_INSCRIPCIONES if c in df.columns]
+        filtro = np.ones(len(df), dtype=bool)
+        if docente is not None and "Docente" in df.columns:
+            filtro &= (df["Docente"].astype(str) == docente).to_numpy()
+        if equipo is not None and "Id_equipo" in df.columns:
+            filtro &= (df["Id_equipo"].astype(str).str.strip() == equipo).to_numpy()
+        posiciones = np.flatnonzero(filtro)
+        for inicio in range(0, len(posiciones), tamano_lote):
+            tramo = df.iloc[posiciones[inicio:inicio + tamano_lote]][columnas]
+            yield tramo.reindex(columns=COLUMNAS_INSCRIPCIONES, fill_value="").astype(str).values.tolist()
+
+    def _equipos_filtrados(self, docente, equipo):
+        """Id_equipo que pasan el filtro (None = todos)."""
+        if docente is None:
+            return None if equipo is None else {equipo}
+        df = self.cargar_inscripciones()
+        equipos = set(df.loc[df["Docente"].astype(str) == docente, "Id_equipo"].astype(str).str.strip())
+        return equipos if equipo is None else equipos & {equipo}
+
+    def iterar_votos(self, docente=None, equipo=None, tamano_lote=5000):
+        if not self.lector.cargado:
+            self._actualizar_votos()
+        equipos = self._equipos_filtrados(docente, equipo)
+        # El lector solo agrega al final de `filas` (o la reemplaza al recargar):
+        # basta con recorrer las `total` filas que había al empezar
+        filas, total = self.lector.filas, len(self.lector.filas)
+        pendientes = {fila[-1]: fila for fila in self.diario.pendientes()}
+        indice_equipo = COLUMNAS_VOTACIONES.index("Id_equipo")
+
+        def todas():
+            for fila in itertools.islice(filas, total):
+                pendientes.pop(fila[-1], None)
+                # Las filas en blanco de la hoja se descartan igual que al armar los DataFrames de votos
+                if self.lector.con_datos(fila):
+                    yield fila
+            yield from list(pendientes.values())
+
+        yield from en_lotes(
+            (f for f in todas() if equipos is None or str(f[indice_equipo]).strip() in equipos), tamano_lote
+        )
+
+    def estado_datos(self, hoja):
+        return self.cache.edad(hoja), self.cache.error(hoja)
+
+    def precargar(self, nombres):
+        """
+        Descarga en una sola llamada (`values_batch_get`) las hojas de
+        `nombres` que no estén vigentes en caché, y "Votaciones" si el lector
+        aún no se cargó. Con una sola hoja pendiente no hace nada: la lectura
+        normal ya es una llamada. Con réplicas, primero se usa lo publicado.
+        """
+        votos = "Votaciones" in nombres
+
+        def cargar(faltan, marca):
+            datos = {}
+            if self.compartido is not None:
+                for nombre in faltan:
+                    valores = self._publicada_vigente(nombre, marca)
+                    if valores is not None:
+                        datos[nombre] = hoja_tipada(nombre, valores)
+                faltan = [n for n in faltan if n not in datos]
+                if votos and not self.lector.cargado:
+                    with self._lock_votos:
+                        self._seguir_votos()
+            con_votos = votos and not self.lector.cargado
+            if len(faltan) + con_votos < 2:
+                return datos
+            rangos = [gspread.utils.absolute_range_name(n) for n in faltan]
+            if con_votos:
+                rangos.append(self.lector.rango_completo)
+            valores = self.conexion.leer_rangos(rangos)
+            if con_votos:
+                self.lector.iniciar(valores[-1], marca)
+            for nombre, valores_hoja in zip(faltan, valores):
+                if self.compartido is not None:
+                    self.compartido.publicar_hoja(nombre, valores_hoja, marca)
+                datos[nombre] = hoja_tipada(nombre, valores_hoja)
+            return datos
+
+        with self._lock_precarga:
+            self.cache.cargar_lote([n for n in nombres if n in self.HOJAS_EN_CACHE], cargar)
+
+
+class RepositorioSQLite(RepositorioConcurso):
+    """
+    Almacenamiento en una base SQLite local con índices.
+
+    Las consultas son locales (milisegundos). Si se indica `conexion`, Google
+    Sheets queda como espejo asíncrono: los votos se envían a "Votaciones" en
+    segundo plano y las hojas "Docentes" y "Respuestas de formulario 1"
+    (que llenan los organizadores y el Google Form) se copian a la base
+    cada `intervalo_sincronizacion` segundos.
+
+    Varios procesos pueden usar la misma base: con `compartido`, solo el
+    titular del arriendo del espejo copia desde Sheets, y la versión de las
+    inscripciones se guarda en la base para que todos vean el cambio.
+    """
+
+    def __init__(self, ruta, conexion=None, intervalo_sincronizacion=60, compartido=None):
+        super().__init__()
+        self.ruta = ruta
+        self.conexion = conexion
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self.compartido = compartido
+        self.arriendo = f"espejo:{os.path.abspath(ruta)}"
+        self.ultimo_error = None
+        self.diario = DiarioVotos(ruta, conexion, compartido=compartido)
+        self._lock = threading.Lock()
+        self._ultimo_orden = 0
+        self._leido_en = 0.0
+        self._db = abrir_sqlite(ruta)
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS docentes (correo TEXT PRIMARY KEY, codigo TEXT)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS inscripciones (
+                id_equipo TEXT, docente TEXT, equipo TEXT, participantes TEXT
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_inscripciones_equipo ON inscripciones (id_equipo)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_inscripciones_docente ON inscripciones (docente)")
+        if conexion is not None:
+            if self._es_espejo():
+                if len(self.diario) == 0:
+                    self._importar_votos()
+                self._sincronizar()
+            self._hilo = threading.Thread(target=self._bucle, name="espejo-sheets", daemon=True)
+            self._hilo.start()
+
+    def _consulta(self, sql, hoja=None):
+        with self._lock:
+            df = pd.read_sql_query(sql, self._db)
+        return tipar_columnas(df, ESQUEMAS_HOJAS.get(hoja, {}))
+
+    def cargar_inscripciones(self):
+        return self._consulta(
+            "SELECT docente AS Docente, participantes AS Participantes, id_equipo AS Id_equipo, equipo AS Equipo "
+            "FROM inscripciones",
+            "Respuestas de formulario 1",
+        )
+
+    def _meta(self, clave):
+        with self._lock:
+            fila = self._db.execute("SELECT valor FROM meta WHERE clave = ?", (clave,)).fetchone()
+        return None if fila is None else fila[0]
+
+    def _es_espejo(self):
+        """True si este proceso copia desde Sheets (siempre, si no hay estado compartido)."""
+        return self.compartido is None or self.compartido.arriendo(self.arriendo, self.intervalo_sincronizacion * 3)
+
+    def version_inscripciones(self):
+        return int(self._meta("version_inscripciones") or 0)
+
+    def estado_datos(self, hoja):
+        if self.conexion is None or hoja not in ("Docentes", "Respuestas de formulario 1"):
+            return None, None
+        sincronizado = self._meta("sincronizado")
+        return None if sincronizado is None else time.time() - sincronizado, self.ultimo_error
+
+    def cargar_docentes(self, fresco=False):
+        if fresco and self.conexion is not None and self._es_espejo():
+            self._sincronizar()
+        return self._consulta("SELECT correo AS Correo, codigo AS Codigo FROM docentes", "Docentes")
+
+    def cargar_votos(self):
+        filas, _ = self.diario.votos_desde(0)
+        return votos_dataframe(filas)
+
+    def votos_conocidos(self):
+        return self.cargar_votos()
+
+    def _lotes_consulta(self, sql, parametros, tamano_lote):
+        """Filas de una consulta en lotes, con una conexión propia para no retener `_lock` mientras se exporta."""
+        db = abrir_sqlite(self.ruta)
+        try:
+            cursor = db.execute(sql, parametros)
+            while lote := cursor.fetchmany(tamano_lote):
+                yield [list(fila) for fila in lote]
+        finally:
+            db.close()
+
+    def iterar_inscripciones(self, docente=None, equipo=None, tamano_lote=5000):
+        condiciones, parametros = [], []
+        if docente is not None:
+            condiciones.append("docente = ?")
+            parametros.append(docente)
+        if equipo is not None:
+            condiciones.append("id_equipo = ?")
+            parametros.append(equipo)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return self._lotes_consulta(
+            f"SELECT docente, participantes, id_equipo, equipo FROM inscripciones {donde} ORDER BY rowid",
+            parametros, tamano_lote,
+        )
+
+    def iterar_votos(self, docente=None, equipo=None, tamano_lote=5000):
+        condiciones, parametros = [], []
+        if docente is not None:
+            condiciones.append("id_equipo IN (SELECT id_equipo FROM inscripciones WHERE docente = ?)")
+            parametros.append(docente)
+        if equipo is not None:
+            condiciones.append("id_equipo = ?")
+            parametros.append(equipo)
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        return self._lotes_consulta(
+            f"SELECT {', '.join(COLUMNAS_SQL_VOTOS)} FROM votos {donde} ORDER BY orden", parametros, tamano_lote
+        )
+
+    def leer_votos_nuevos(self, intervalo_minimo=0):
+        with self._lock:
+            if time.monotonic() - self._leido_en < intervalo_minimo:
+                return [], False
+            self._leido_en = time.monotonic()
+            filas, self._ultimo_orden = self.diario.votos_desde(self._ultimo_orden)
+        if filas:
+            self._publicar(votos_dataframe(filas), False)
+        return filas, False
+
+    def registrar_voto(self, registro):
+        if not self.diario.registrar(registro):
+            return False
+        self._publicar(votos_dataframe([registro]), False)
+        return True
+
+    def _importar_votos(self):
+        """Copia a la base los votos que ya estaban en la hoja (una sola vez)."""
+        lector = LectorIncremental(self.conexion, "Votaciones", COLUMNAS_VOTACIONES)
+        filas, _ = lector.actualizar()
+        # Las filas antiguas sin Id_voto reciben uno derivado de su posición en la hoja
+        self.diario.importar([
+            f[:-1] + [f[-1] or f"hoja-{n}"] for n, f in enumerate(filas, start=2) if lector.con_datos(f)
+        ])
+
+    def _sincronizar(self):
+        """Copia Docentes y Respuestas de formulario 1 desde Sheets a la base."""
+        try:
+            hojas = self.conexion.leer_hojas(["Docentes", "Respuestas de formulario 1"])
+            docentes = hojas["Docentes"]
+            inscripciones = normalizar_inscripciones(hojas["Respuestas de formulario 1"])
+            filas_docentes = [] if docentes.empty else list(
+                docentes[["Correo", "Codigo"]].astype(str).itertuples(index=False, name=None)
+            )
+            filas_inscripciones = [] if inscripciones.empty else list(
+                inscripciones[["Id_equipo", "Docente", "Equipo", "Participantes"]]
+                .astype(str).itertuples(index=False, name=None)
+            )
+        except Exception as e:
+            self.ultimo_error = e
+            logger.warning("No se pudo sincronizar desde Sheets: %s", e)
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM docentes")
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO docentes (correo, codigo) VALUES (?, ?)", filas_docentes
+                )
+                self._db.execute("DELETE FROM inscripciones")
+                self._db.executemany(
+                    "INSERT INTO inscripciones (id_equipo, docente, equipo, participantes) VALUES (?, ?, ?, ?)",
+                    filas_inscripciones,
+                )
+                self._db.execute(
+                    "INSERT INTO meta (clave, valor) VALUES ('version_inscripciones', 1) "
+                    "ON CONFLICT (clave) DO UPDATE SET valor = valor + 1"
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('sincronizado', ?)", (time.time(),)
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                # Sin ROLLBACK la conexión retendría el bloqueo de escritura de la base (y de los votos)
+                self._db.execute("ROLLBACK")
+                raise
+        self.ultimo_error = None
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo_sincronizacion)
+            try:
+                if self._es_espejo():
+                    self._sincronizar()
+            except Exception as e:
+                self.ultimo_error = e
+                logger.warning("Falló la sincronización del espejo de Sheets: %s", e)
+
+
+def _clave_almacenamiento(secrets):
+    """
+    Configuración de almacenamiento desde `[almacenamiento]` en secrets:
+    motor ("sheets" o "sqlite"), ruta del archivo local y si se usa Sheets
+    como espejo (por defecto, si hay credenciales de GCP).
+    """
+    config = secrets.get("almacenamiento", {})
+    motor = config.get("motor", "sheets")
+    ruta = config.get("ruta", RUTA_DIARIO_VOTOS if motor == "sheets" else RUTA_BASE_LOCAL)
+    espejo = motor == "sheets" or bool(config.get("espejo_sheets", "gcp" in secrets))
+    spreadsheet_id = secrets["spreadsheet"]["id"] if espejo else None
+    return motor, ruta, espejo, spreadsheet_id
+
+
+@st.cache_resource(show_spinner=False)
+def _repositorio_compartido(clave, _secrets):
+    motor, ruta, espejo, _ = clave
+    conexion = obtener_conexion(_secrets) if espejo else None
+    compartido = obtener_estado_compartido(_secrets)
+    if motor == "sqlite":
+        return RepositorioSQLite(ruta, conexion, compartido=compartido)
+    if motor == "sheets":
+        return RepositorioSheets(
+            conexion, obtener_cache(_secrets), DiarioVotos(ruta, conexion, compartido=compartido), compartido
+        )
+    raise ValueError(f"Motor de almacenamiento desconocido: {motor}")
+
+
+def obtener_repositorio(secrets):
+    """Devuelve el repositorio configurado del proceso (Sheets por defecto)."""
+    return _repositorio_compartido(_clave_almacenamiento(secrets), secrets)
+
+
+def cargar_docentes(secrets):
+    return obtener_repositorio(secrets).cargar_docentes()
+
+
+def precargar_hojas(secrets, nombres):
+    """
+    Trae en una sola llamada las hojas que va a usar una pantalla. Es solo
+    una optimización: si falla, cada lectura se hace luego por su cuenta.
+    """
+    try:
+        obtener_repositorio(secrets).precargar(nombres)
+    except Exception as e:
+        logger.info("No se pudieron precargar %s: %s", nombres, e)
+
+
+def cargar_respuestas_formulario(secrets):
+    """
+    Carga las inscripciones ('Respuestas de formulario 1')
+    y devuelve un DataFrame listo para usar en el dashboard.
+    """
+    return obtener_repositorio(secrets).cargar_inscripciones()
+
+
+def normalizar_correo(correo):
+    return str(correo or "").strip().lower()
+
+
+class IndiceVotos:
+    """
+    Índice en memoria de los pares (correo normalizado, Id_equipo) que ya votaron.
+
+    Se construye una vez a partir de la hoja Votaciones y se actualiza con cada
+    voto aceptado, así la verificación de voto duplicado es una búsqueda en un
+    set compartido por todas las sesiones, sin tocar la red. Con `compartido`,
+    los pares se reclaman además en el estado común de las réplicas, así un
+    mismo correo no puede votar dos veces por un equipo entrando por dos procesos.
+    En cada recarga completa de Votaciones el índice se reconstruye desde la
+    hoja (`reconstruir`), conservando los pares reclamados hace menos de
+    `margen` segundos que aún pueden estar en camino a la hoja.
+    """
+
+    def __init__(self, df_votos=None, compartido=None, margen=600):
+        self._lock = threading.Lock()
+        self._pares = set()
+        self._recientes = {}
+        self.compartido = compartido
+        self.margen = margen
+        if df_votos is not None and not df_votos.empty:
+            self.agregar_votos(df_votos)
+
+    @staticmethod
+    def _clave(correo, equipo_id):
+        return normalizar_correo(correo), str(equipo_id).strip()
+
+    @staticmethod
+    def _pares_de(df_votos):
+        if df_votos.empty:
+            return set()
+        correos = df_votos["Correo"].astype(str).str.strip().str.lower()
+        equipos = df_votos["Id_equipo"].astype(str).str.strip()
+        return set(zip(correos, equipos))
+
+    def agregar_votos(self, df_votos):
+        """Incorpora al índice los votos de un DataFrame de la hoja Votaciones."""
+        pares = self._pares_de(df_votos)
+        with self._lock:
+            self._pares.update(pares)
+
+    def reconstruir(self, df_votos, pendientes=()):
+        """
+        Reemplaza el índice por los votos de una lectura completa de Votaciones
+        más los votos aceptados que aún no llegan a la hoja (`pendientes`).
+        """
+        indice_correo, indice_equipo = COLUMNAS_VOTACIONES.index("Correo"), COLUMNAS_VOTACIONES.index("Id_equipo")
+        pares = self._pares_de(df_votos) | {self._clave(f[indice_correo], f[indice_equipo]) for f in pendientes}
+        with self._lock:
+            limite = time.monotonic() - self.margen
+            self._recientes = {clave: t for clave, t in self._recientes.items() if t >= limite}
+            self._pares = pares | set(self._recientes)
+            if self.compartido is not None:
+                self.compartido.reconciliar_pares(pares, self.margen)
+
+    def ya_voto(self, correo, equipo_id):
+        clave = self._clave(correo, equipo_id)
+        return clave in self._pares or (self.compartido is not None and self.compartido.par_votado(*clave))
+
+    def registrar(self, correo, equipo_id):
+        """
+        Marca el par como votado de forma atómica.
+
+        :return: False si el par ya había votado
+        """
+        clave = self._clave(correo, equipo_id)
+        with self._lock:
+            if clave in self._pares:
+                return False
+            self._pares.add(clave)
+            self._recientes[clave] = time.monotonic()
+            if self.compartido is not None and not self.compartido.reclamar_par(*clave):
+                return False
+            return True
+
+    def descartar(self, correo, equipo_id):
+        """Revierte `registrar` si el voto no llegó a guardarse."""
+        clave = self._clave(correo, equipo_id)
+        with self._lock:
+            self._pares.discard(clave)
+            self._recientes.pop(clave, None)
+            if self.compartido is not None:
+                self.compartido.liberar_par(*clave)
+
+    def __len__(self):
+        return len(self._pares)
+
+
+@st.cache_resource(show_spinner=False)
+def _indice_votos_compartido(clave, _repositorio, _compartido):
+    indice = IndiceVotos(compartido=_compartido)
+    # Al arrancar, los pares compartidos se alinean con lo que hay en el almacenamiento
+    indice.reconstruir(_repositorio.cargar_votos())
+
+    def aplicar(df_nuevos, recargado):
+        # Los votos nuevos (de esta u otras sesiones y procesos) se suman; una recarga reconstruye
+        if recargado:
+            indice.reconstruir(df_nuevos, _repositorio.votos_pendientes())
+        else:
+            indice.agregar_votos(df_nuevos)
+
+    _repositorio.suscribir(aplicar)
+    return indice
+
+
+def obtener_indice_votos(secrets):
+    """Devuelve el índice de votos del proceso (se construye en la primera llamada)."""
+    return _indice_votos_compartido(
+        _clave_almacenamiento(secrets), obtener_repositorio(secrets), obtener_estado_compartido(secrets)
+    )
+
+
+class VotoDuplicado(Exception):
+    """El correo ya votó por el equipo con otro intento de voto."""
+
+
+class AlmacenIdempotencia:
+    """
+    Resultados de operaciones ya hechas, por clave de idempotencia.
+
+    Un reintento con la misma clave (doble clic, re-ejecución de Streamlit o
+    reintento de red) recibe el resultado original sin repetir la operación;
+    si la original sigue en curso, espera a que termine. Una operación que
+    falla no se guarda, así el reintento la vuelve a intentar. Guarda como
+    mucho `max_entradas` claves (descarta las más antiguas) durante
+    `vigencia` segundos. Con `compartido`, los resultados también se guardan
+    en el estado común, así un reintento que llega a otra réplica los encuentra.
+    """
+
+    def __init__(self, max_entradas=20000, vigencia=6 * 3600, compartido=None):
+        self.max_entradas = max_entradas
+        self.vigencia = vigencia
+        self.compartido = compartido
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (resultado, guardado_en)
+        self._en_curso = {}  # clave -> threading.Event
+
+    def _purgar(self):
+        limite = time.monotonic() - self.vigencia
+        while self._entradas and (
+            len(self._entradas) > self.max_entradas or next(iter(self._entradas.values()))[1] < limite
+        ):
+            self._entradas.popitem(last=False)
+
+    def ejecutar(self, clave, operacion, espera_maxima=30.0):
+        """
+        Ejecuta `operacion()` una sola vez por clave.
+
+        :return: (resultado, True si es el resultado guardado de un intento anterior)
+        :raises TimeoutError: si el intento en curso con la misma clave no termina a tiempo
+        """
+        while True:
+            with self._lock:
+                self._purgar()
+                entrada = self._entradas.get(clave)
+                if entrada is not None:
+                    return entrada[0], True
+                evento = self._en_curso.get(clave)
+                if evento is None:
+                    self._en_curso[clave] = threading.Event()
+                    break
+            if not evento.wait(espera_maxima):
+                raise TimeoutError(f"La operación {clave} sigue en curso")
+
+        try:
+            guardado = None if self.compartido is None else self.compartido.resultado(clave, self.vigencia)
+            resultado = operacion() if guardado is None else guardado
+            if guardado is None and self.compartido is not None:
+                self.compartido.guardar_resultado(clave, resultado, self.vigencia)
+        except BaseException:
+            with self._lock:
+                self._en_curso.pop(clave).set()
+            raise
+        with self._lock:
+            self._entradas[clave] = (resultado, time.monotonic())
+            self._purgar()
+            self._en_curso.pop(clave).set()
+        return resultado, guardado is not None
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+@st.cache_resource(show_spinner=False)
+def _almacen_idempotencia(_compartido):
+    return AlmacenIdempotencia(compartido=_compartido)
+
+
+def obtener_almacen_idempotencia(secrets):
+    """Devuelve el almacén de idempotencia de votos del proceso."""
+    return _almacen_idempotencia(obtener_estado_compartido(secrets))
+
+
+def registrar_voto_idempotente(secrets, registro, indice_votos):
+    """
+    Registra un voto una sola vez por Id_voto (último campo del registro).
+
+    El Id_voto se genera al mostrar el formulario, así un reenvío del mismo
+    intento devuelve el resultado original sin una segunda escritura.
+
+    :return: (fecha con la que quedó registrado el voto, True si ya estaba registrado)
+    :raises VotoDuplicado: si el correo ya votó por el equipo con otro intento
+    """
+    correo, equipo_id, id_voto = registro[2], registro[3], registro[-1]
+
+    def registrar():
+        if not indice_votos.registrar(correo, equipo_id):
+            raise VotoDuplicado(equipo_id)
+        try:
+            obtener_repositorio(secrets).registrar_voto(registro)
+        except Exception:
+            indice_votos.descartar(correo, equipo_id)
+            raise
+        return registro[0]
+
+    return obtener_almacen_idempotencia(secrets).ejecutar(id_voto, registrar)
+
+
+class IndiceDocentes:
+    """
+    Índice compartido de credenciales docentes: correo normalizado → HMAC del código.
+
+    Los códigos no se guardan en claro ni en la sesión de cada usuario; se
+    comparan con `hmac.compare_digest` en tiempo constante. Un hilo refresca
+    el índice cada `intervalo` segundos, así el login no lee la hoja; solo un
+    correo desconocido fuerza una recarga, como mucho cada `refresco_minimo`
+    segundos (p. ej. un docente recién agregado).
+    """
+
+    def __init__(self, repositorio, intervalo=300, refresco_minimo=60):
+        self.repositorio = repositorio
+        self.intervalo = intervalo
+        self.refresco_minimo = refresco_minimo
+        self._clave_hmac = os.urandom(32)
+        self._lock = threading.Lock()
+        self._codigos = {}
+        self._cargado_en = 0.0
+        self.ultimo_error = None
+        self.refrescar()
+        self._hilo = threading.Thread(target=self._bucle, name="indice-docentes", daemon=True)
+        self._hilo.start()
+
+    def _hash(self, codigo):
+        return hmac.new(self._clave_hmac, str(codigo).strip().encode(), hashlib.sha256).digest()
+
+    def refrescar(self, fresco=False):
+        """
+        Reconstruye el índice desde la hoja Docentes (vía el repositorio).
+
+        :param fresco: leer la hoja sin pasar por la caché (docente recién agregado)
+        """
+        with self._lock:
+            self._cargado_en = time.monotonic()
+        try:
+            df = self.repositorio.cargar_docentes(fresco=fresco)
+            codigos = {
+                normalizar_correo(correo): self._hash(codigo)
+                for correo, codigo in zip(df["Correo"], df["Codigo"])
+                if normalizar_correo(correo)
+            }
+        except Exception as e:
+            self.ultimo_error = e
+            logger.warning("No se pudo actualizar el índice de docentes: %s", e)
+            return False
+        with self._lock:
+            self._codigos = codigos
+        self.ultimo_error = None
+        return True
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.refrescar()
+
+    def contiene(self, correo):
+        correo = normalizar_correo(correo)
+        if correo in self._codigos:
+            return True
+        if time.monotonic() - self._cargado_en >= self.refresco_minimo:
+            self.refrescar(fresco=True)
+        return correo in self._codigos
+
+    def verificar(self, correo, codigo):
+        """
+        Comprueba el código de validación del docente.
+
+        :return: True si el correo está registrado y el código coincide
+        """
+        esperado = self._codigos.get(normalizar_correo(correo))
+        recibido = self._hash(codigo)
+        if esperado is None:
+            hmac.compare_digest(recibido, recibido)
+            return False
+        return hmac.compare_digest(esperado, recibido)
+
+    def __len__(self):
+        return len(self._codigos)
+
+
+@st.cache_resource(show_spinner=False)
+def _indice_docentes_compartido(clave, _repositorio):
+    return IndiceDocentes(_repositorio)
+
+
+def obtener_indice_docentes(secrets):
+    """Devuelve el índice de credenciales docentes del proceso."""
+    return _indice_docentes_compartido(_clave_almacenamiento(secrets), obtener_repositorio(secrets))
+
+
+COLUMNAS_INSCRIPCIONES = ["Docente", "Participantes", "Id_equipo", "Equipo"]
+
+
+COLUMNAS_DETALLE_INSCRIPCIONES = ["Equipo", "Docente", "Cantidad de Estudiantes", "Id_equipo"]
+
+ResumenInscripciones = namedtuple("ResumenInscripciones", "inscripciones equipos estudiantes")
+
+
+def grafico_inscripciones_por_docente(resumen):
+    """Gráfico de barras de estudiantes por docente (columnas Docente y Cantidad de Estudiantes)."""
+    return (
+        alt.Chart(resumen)
+        .mark_bar(size=35, cornerRadiusTopLeft=8, cornerRadiusTopRight=8)
+        .encode(
+            x=alt.X('Docente:N', sort='-y', title="Docente"),
+            y=alt.Y('Cantidad de Estudiantes:Q', title="Estudiantes"),
+            color=alt.value('#1B396A'),
+            tooltip=['Docente', 'Cantidad de Estudiantes']
+        )
+        .properties(height=350)
+    )
+
+
+class RegistroEquipos:
+    """
+    Foto inmutable de las inscripciones, lista para consultar.
+
+    Guarda el set de Id_equipo (normalizados con strip), el docente de cada
+    equipo y el DataFrame de inscripciones con la columna "Cantidad de
+    Estudiantes" ya calculada. Los agregados por
+    docente se calculan una vez por versión, así filtrar el dashboard es una
+    búsqueda en un dict; las especificaciones de gráficos se memorizan por
+    filtro. Nadie debe modificar `inscripciones`: la comparten todas las
+    sesiones.
+    """
+
+    def __init__(self, version, df_inscripciones):
+        self.version = version
+        self.columnas_faltantes = [c for c in COLUMNAS_INSCRIPCIONES if c not in df_inscripciones.columns]
+        df = df_inscripciones.copy()
+        self._detalle = {}
+        self._resumenes = {}
+        self._graficos = {}
+        self.docentes = []
+        if not self.columnas_faltantes:
+            df["Id_equipo"] = df["Id_equipo"].astype(str).str.strip()
+            df["Cantidad de Estudiantes"] = contar_participantes_serie(df["Participantes"])
+            equipos = df.drop_duplicates("Id_equipo", keep="last").set_index("Id_equipo")
+            self.ids = frozenset(equipos.index)
+            self.docente_por_equipo = equipos["Docente"].to_dict()
+            self._precalcular(df)
+        else:
+            self.ids = frozenset()
+            self.docente_por_equipo = {}
+        self.inscripciones = df
+
+    def _precalcular(self, df):
+        detalle = df[COLUMNAS_DETALLE_INSCRIPCIONES]
+        self._detalle[None] = detalle
+        self._resumenes[None] = ResumenInscripciones(
+            len(df), df["Id_equipo"].nunique(), int(df["Cantidad de Estudiantes"].sum())
+        )
+        agregados = df.groupby("Docente", sort=False, dropna=False, observed=True).agg(
+            inscripciones=("Id_equipo", "size"),
+            equipos=("Id_equipo", "nunique"),
+            estudiantes=("Cantidad de Estudiantes", "sum"),
+        )
+        for docente, fila in agregados.iterrows():
+            self._resumenes[docente] = ResumenInscripciones(
+                int(fila["inscripciones"]), int(fila["equipos"]), int(fila["estudiantes"])
+            )
+        for docente, indices in df.groupby("Docente", sort=False, dropna=False, observed=True).indices.items():
+            self._detalle[docente] = detalle.iloc[indices]
+        self.docentes = list(agregados.index)
+        self._por_docente = agregados["estudiantes"].rename("Cantidad de Estudiantes").rename_axis("Docente")
+
+    def existe(self, equipo_id):
+        return str(equipo_id).strip() in self.ids
+
+    def resumen(self, docente=None):
+        """Inscripciones, equipos y estudiantes de un docente (o de todos si es None)."""
+        return self._resumenes.get(docente, ResumenInscripciones(0, 0, 0))
+
+    def detalle(self, docente=None):
+        """Tabla de detalle (Equipo, Docente, Cantidad de Estudiantes, Id_equipo) filtrada por docente."""
+        return self._detalle.get(docente, self.inscripciones.iloc[0:0])
+
+    def spec_grafico_docentes(self, docente=None):
+        """Especificación Vega-Lite del gráfico por docente, memorizada por filtro."""
+        spec = self._graficos.get(docente)
+        if spec is None:
+            por_docente = self._por_docente if docente is None else self._por_docente.loc[[docente]]
+            spec = grafico_inscripciones_por_docente(por_docente.reset_index()).to_dict()
+            self._graficos[docente] = spec
+        return spec
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class CatalogoEquipos:
+    """
+    Registro de equipos compartido por el proceso.
 
-    :param secrets: credenciales de GCP desde st.secrets
-    :param hoja_nombre: nombre de la hoja específica a leer (opcional)
-    :return: pd.DataFrame con los datos de la hoja
+    `actual()` consulta la versión de las inscripciones en el repositorio y
+    solo reconstruye el registro cuando cambió; si una recarga trae los
+    mismos datos (misma huella), conserva el registro y su versión. Si la
+    consulta falla y ya hay un registro, se sigue sirviendo el anterior.
     """
-    credentials = service_account.Credentials.from_service_account_info(
-        secrets["gcp"],
-        scopes=["https://www.googleapis.com/auth/spreadsheets"]
-    )
-    gc = gspread.authorize(credentials)
-    sh = gc.open_by_key(secrets["spreadsheet"]["id"])
 
-    if hoja_nombre:
-        worksheet = sh.worksheet(hoja_nombre)
-    else:
-        worksheet = sh.sheet1  # por defecto la primera hoja
+    def __init__(self, repositorio):
+        self.repositorio = repositorio
+        self._lock = threading.Lock()
+        self._version_origen = None
+        self._huella = None
+        self._registro = None
 
-    data = worksheet.get_all_records()
-    return pd.DataFrame(data)
+    def actual(self):
+        """
+        :return: RegistroEquipos vigente
+        """
+        try:
+            return self._actualizar()
+        except Exception as e:
+            if self._registro is None:
+                raise
+            logger.warning("Inscripciones no disponibles; se sirve el registro anterior: %s", e)
+            return self._registro
 
-def contar_participantes(participantes_str):
-    if not participantes_str:
-        return 0
-    estudiantes = [p.strip() for p in participantes_str.split(',') if p.strip()]
-    return len(estudiantes)
+    def _actualizar(self):
+        version_origen = self.repositorio.version_inscripciones()
+        with self._lock:
+            if version_origen == self._version_origen and self._registro is not None:
+                return self._registro
+            df = self.repositorio.cargar_inscripciones()
+            huella = int(pd.util.hash_pandas_object(df, index=False).sum()) if not df.empty else 0
+            if self._registro is None or huella != self._huella:
+                version = 1 if self._registro is None else self._registro.version + 1
+                self._registro = RegistroEquipos(version, df)
+                self._huella = huella
+            self._version_origen = version_origen
+            return self._registro
 
 
-def cargar_docentes(secrets):
-    credentials = service_account.Credentials.from_service_account_info(
-        secrets["gcp"],
-        scopes=["https://www.googleapis.com/auth/spreadsheets"]
-    )
-    gc = gspread.authorize(credentials)
-    sh = gc.open_by_key(secrets["spreadsheet"]["id"])
-    # Intenta abrir la hoja Docentes
-    ws_docentes = sh.worksheet("Docentes")
-    data = ws_docentes.get_all_records()
-    return pd.DataFrame(data)
+@st.cache_resource(show_spinner=False)
+def _catalogo_equipos_compartido(clave, _repositorio):
+    return CatalogoEquipos(_repositorio)
 
 
-def cargar_respuestas_formulario(secrets):
+def obtener_registro_equipos(secrets):
+    """Devuelve el registro de equipos vigente (se reconstruye solo si cambió la hoja)."""
+    return _catalogo_equipos_compartido(_clave_almacenamiento(secrets), obtener_repositorio(secrets)).actual()
+
+
+ROLES_VOTANTE = ["Docente", "Estudiante"]
+
+# Normalizaciones disponibles para el ranking (clave → etiqueta en pantalla)
+MODOS_PUNTAJE = {
+    "suma": "Suma de puntajes",
+    "promedio": "Promedio por votante",
+    "z": "Puntaje z por rol",
+}
+
+Escenario = namedtuple("Escenario", "nombre modo pesos_rol pesos_criterio")
+
+
+class TensorPuntajes:
     """
-    Carga la hoja 'Respuestas de formulario 1' del Google Sheet
-    y devuelve un DataFrame listo para usar en el dashboard.
+    Votos de todos los equipos en un tensor equipo × rol × criterio, para
+    comparar muchas ponderaciones a la vez.
+
+    Por celda guarda la suma de puntajes y la suma de cuadrados, y por equipo y
+    rol el número de votos. Cada modo de `MODOS_PUNTAJE` se reduce a una matriz
+    equipo × (rol, criterio) y cada escenario a un vector de pesos sobre esas
+    columnas: N escenarios se evalúan con un solo producto matricial y se
+    ordenan juntos con `np.lexsort`.
+
+    - suma: puntaje acumulado (el del tablero público).
+    - promedio: puntaje medio por votante de cada rol; no premia recibir más votos.
+    - z: promedio de cada rol estandarizado con la media y desviación de todos
+      los votos de ese rol y criterio, porque docentes y estudiantes califican
+      criterios distintos con escalas distintas. Sin votos de un rol, vale 0.
+    """
+
+    def __init__(self, equipos, sumas, cuadrados, votos):
+        equipos = np.asarray(equipos, dtype=str)
+        orden = np.argsort(equipos, kind="stable")
+        forma = (len(equipos), len(ROLES_VOTANTE), len(CRITERIOS))
+        self.equipos = equipos[orden]
+        self.sumas = np.asarray(sumas, dtype=float).reshape(forma)[orden]
+        self.cuadrados = np.asarray(cuadrados, dtype=float).reshape(forma)[orden]
+        self.votos = np.asarray(votos, dtype=float).reshape(forma[:2])[orden]
+        self._matrices = {}
+
+    def __len__(self):
+        return len(self.equipos)
+
+    def matriz(self, modo):
+        """Matriz equipo × (rol, criterio) del modo de puntaje indicado (se calcula una vez)."""
+        if modo in self._matrices:
+            return self._matrices[modo]
+        votos = self.votos[:, :, None]
+        if modo == "suma":
+            valores = self.sumas
+        elif modo == "promedio":
+            valores = np.divide(self.sumas, votos, out=np.zeros_like(self.sumas), where=votos > 0)
+        elif modo == "z":
+            total = self.votos.sum(axis=0)[:, None]
+            media = np.divide(self.sumas.sum(axis=0), total, out=np.zeros(self.sumas.shape[1:]), where=total > 0)
+            cuadrados = np.divide(
+                self.cuadrados.sum(axis=0), total, out=np.zeros(self.sumas.shape[1:]), where=total > 0
+            )
+            desviacion = np.sqrt(np.clip(cuadrados - media ** 2, 0, None))
+            desviacion[desviacion == 0] = 1.0
+            promedio = self.matriz("promedio").reshape(self.sumas.shape)
+            valores = np.where(votos > 0, (promedio - media) / desviacion, 0.0)
+        else:
+            raise ValueError(f"Modo de puntaje desconocido: {modo}")
+        self._matrices[modo] = valores.reshape(len(self), len(ROLES_VOTANTE) * len(CRITERIOS))
+        return self._matrices[modo]
+
+    def evaluar(self, escenarios):
+        """
+        Puntaje de cada equipo en cada escenario.
+
+        :param escenarios: lista de Escenario (pesos por rol en el orden de ROLES_VOTANTE
+                           y por criterio en el orden de CRITERIOS)
+        :return: matriz equipos × escenarios
+        """
+        modos = list(dict.fromkeys(e.modo for e in escenarios))
+        bloque = len(ROLES_VOTANTE) * len(CRITERIOS)
+        pesos = np.zeros((len(modos) * bloque, len(escenarios)))
+        for j, escenario in enumerate(escenarios):
+            inicio = modos.index(escenario.modo) * bloque
+            pesos[inicio:inicio + bloque, j] = np.outer(escenario.pesos_rol, escenario.pesos_criterio).ravel()
+        if not modos:
+            return np.zeros((len(self), 0))
+        return np.hstack([self.matriz(m) for m in modos]) @ pesos
+
+    def clasificar(self, escenarios):
+        """
+        Orden de los equipos en cada escenario: mayor puntaje primero; los empates
+        se resuelven por más votos y luego por Id_equipo, igual en todos los escenarios.
+
+        :return: (puntajes equipos × escenarios, orden escenarios × equipos con índices de equipo)
+        """
+        puntajes = self.evaluar(escenarios)
+        forma = (puntajes.shape[1], len(self))
+        # Redondeo para que sumas en distinto orden no rompan empates reales
+        claves = (
+            np.broadcast_to(np.arange(len(self)), forma),
+            np.broadcast_to(-self.votos.sum(axis=1), forma),
+            -np.round(puntajes.T, 9),
+        )
+        return puntajes, np.lexsort(claves, axis=-1)
+
+    def tablas(self, escenarios):
+        """
+        Puesto y puntaje de cada equipo por escenario.
+
+        :return: (DataFrame de puestos, DataFrame de puntajes), indexados por Id_equipo
+                 y con una columna por escenario
+        """
+        puntajes, orden = self.clasificar(escenarios)
+        puestos = np.empty_like(orden)
+        np.put_along_axis(puestos, orden, np.arange(1, len(self) + 1)[None, :], axis=1)
+        indice = pd.Index(self.equipos, name="Id_equipo")
+        columnas = [e.nombre for e in escenarios]
+        return (
+            pd.DataFrame(puestos.T, index=indice, columns=columnas),
+            pd.DataFrame(puntajes, index=indice, columns=columnas),
+        )
+
+
+class MotorPuntajes:
+    """
+    Puntajes acumulados por equipo, actualizados por deltas.
+
+    Por cada equipo guarda la suma de puntajes y el número de votos de
+    docentes y de estudiantes, la suma de cada criterio y, por rol, la suma y
+    la suma de cuadrados de cada criterio. Los votos nuevos se suman con un
+    solo groupby sobre el delta; el ranking se calcula sobre un
+    `TensorPuntajes` que se reconstruye solo cuando cambia la versión, sin
+    recorrer la historia de votos.
+    Los votos con Id_voto se cuentan una sola vez aunque lleguen por dos vías
+    (voto local recién aceptado y luego la misma fila leída de la hoja).
+    """
+
+    # Posiciones del acumulado por equipo
+    SUMA_DOC, SUMA_EST, N_DOC, N_EST = 0, 1, 2, 3
+    POR_ROL = 4 + len(CRITERIOS)
+    CUADRADOS_POR_ROL = POR_ROL + len(ROLES_VOTANTE) * len(CRITERIOS)
+    ANCHO = CUADRADOS_POR_ROL + len(ROLES_VOTANTE) * len(CRITERIOS)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._equipos = {}
+            self._contados = set()
+            self._tensor = None
+            self.version += 1
+
+    def agregar(self, df_votos):
+        """Suma al acumulado los votos de un DataFrame de la hoja Votaciones."""
+        if df_votos.empty:
+            return
+        with self._lock:
+            if "Id_voto" in df_votos.columns:
+                ids = df_votos["Id_voto"].astype(str)
+                nuevos = ~ids.isin(self._contados) & ~(ids.duplicated() & ids.ne(""))
+                df_votos = df_votos[nuevos]
+                self._contados.update(ids[nuevos & ids.ne("")])
+                if df_votos.empty:
+                    return
+
+            criterios = df_votos[CRITERIOS].apply(pd.to_numeric, errors="coerce").fillna(0).astype("float64")
+            total = criterios.sum(axis=1)
+            docente = df_votos["Rol Votante"].eq("Docente")
+            por_rol = dict(zip(ROLES_VOTANTE, [docente, ~docente]))
+            delta = pd.DataFrame({
+                "suma_doc": total.where(docente, 0),
+                "suma_est": total.where(~docente, 0),
+                "n_doc": docente.astype(int),
+                "n_est": (~docente).astype(int),
+                **{c: criterios[c] for c in CRITERIOS},
+                **{f"{r}|{c}": criterios[c].where(m, 0) for r, m in por_rol.items() for c in CRITERIOS},
+                **{f"{r}|{c}²": (criterios[c] ** 2).where(m, 0) for r, m in por_rol.items() for c in CRITERIOS},
+            }).groupby(df_votos["Id_equipo"].astype(str)).sum()
+
+            for equipo, valores in zip(delta.index, delta.to_numpy().tolist()):
+                acumulado = self._equipos.setdefault(equipo, [0.0] * len(valores))
+                for i, v in enumerate(valores):
+                    acumulado[i] += v
+            self.version += 1
+
+    def aplicar(self, df_votos, recargado, pendientes=()):
+        """Suscriptor del lector incremental: suma deltas o reconstruye tras una recarga."""
+        if recargado:
+            self.reiniciar()
+            if pendientes:
+                self.agregar(votos_dataframe(pendientes))
+        self.agregar(df_votos)
+
+    def num_equipos(self):
+        return len(self._equipos)
+
+    def tensor(self):
+        """Tensor equipo × rol × criterio de la versión actual (se reconstruye solo si hubo votos nuevos)."""
+        with self._lock:
+            if self._tensor is None or self._tensor[0] != self.version:
+                equipos = list(self._equipos)
+                acumulado = np.array([self._equipos[e] for e in equipos], dtype=float).reshape(len(equipos), self.ANCHO)
+                self._tensor = (self.version, TensorPuntajes(
+                    equipos,
+                    acumulado[:, self.POR_ROL:self.CUADRADOS_POR_ROL],
+                    acumulado[:, self.CUADRADOS_POR_ROL:],
+                    acumulado[:, [self.N_DOC, self.N_EST]],
+                ))
+            return self._tensor[1]
+
+    def top(self, n, peso_docente=0.5, peso_estudiante=0.5):
+        """
+        Los n mejores equipos por puntaje ponderado (suma de los votos de cada rol).
+
+        :return: DataFrame con Id_equipo, Puntaje_Total y el promedio de cada criterio
+        """
+        tensor = self.tensor()
+        escenario = Escenario("Tablero", "suma", (peso_docente, peso_estudiante), (1.0,) * len(CRITERIOS))
+        puntajes, orden = tensor.clasificar([escenario])
+        mejores = orden[0, :n]
+        votos = np.maximum(tensor.votos[mejores].sum(axis=1), 1)
+        resultados = pd.DataFrame(tensor.sumas[mejores].sum(axis=1) / votos[:, None], columns=CRITERIOS)
+        resultados.insert(0, "Puntaje_Total", puntajes[mejores, 0])
+        resultados.insert(0, "Id_equipo", tensor.equipos[mejores])
+        return resultados
+
+
+@st.cache_resource(show_spinner=False)
+def _motor_puntajes_compartido(clave, _repositorio):
+    motor = MotorPuntajes()
+    _repositorio.suscribir(lambda df_nuevos, recargado: motor.aplicar(
+        df_nuevos, recargado, _repositorio.votos_pendientes() if recargado else ()
+    ))
+    motor.agregar(_repositorio.votos_conocidos())
+    return motor
+
+
+def obtener_motor_puntajes(secrets):
+    """Devuelve el motor de puntajes del proceso, alimentado por los votos nuevos del repositorio."""
+    return _motor_puntajes_compartido(_clave_almacenamiento(secrets), obtener_repositorio(secrets))
+
+
+InstantaneaResultados = namedtuple("InstantaneaResultados", "version generado_en num_equipos resultados")
+
+
+class SondeoResultados:
+    """
+    Sondeo único por proceso de la hoja Votaciones para el tablero de resultados.
+
+    Un hilo en segundo plano trae las filas nuevas cada `intervalo` segundos y
+    el motor de puntajes las acumula. Las sesiones solo leen la instantánea
+    publicada (versionada con la versión del motor), así la carga sobre la API
+    no depende de cuántas pantallas tengan abierto el tablero.
     """
-    # Credenciales
-    credentials = service_account.Credentials.from_service_account_info(
-        secrets["gcp"],
-        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+
+    def __init__(self, repositorio, motor, intervalo=10, top_n=20):
+        self.repositorio = repositorio
+        self.motor = motor
+        self.intervalo = intervalo
+        self.top_n = top_n
+        self.ultimo_error = None
+        self.actualizado_en = None
+        self._lock = threading.Lock()
+        self._instantaneas = {}
+        self._sondear()
+        self._hilo = threading.Thread(target=self._bucle, name="sondeo-resultados", daemon=True)
+        self._hilo.start()
+
+    def _sondear(self):
+        try:
+            self.repositorio.leer_votos_nuevos()
+            self.actualizado_en = datetime.now()
+            self.ultimo_error = None
+        except Exception as e:
+            self.ultimo_error = e
+            logger.warning("No se pudieron actualizar los resultados: %s", e)
+
+    def _bucle(self):
+        while True:
+            time.sleep(self.intervalo)
+            self._sondear()
+
+    def instantanea(self, peso_docente=0.5, peso_estudiante=0.5):
+        """
+        Ranking publicado para la ponderación indicada.
+        Se recalcula como mucho una vez por versión del motor.
+        """
+        clave = (peso_docente, peso_estudiante)
+        version = self.motor.version
+        with self._lock:
+            actual = self._instantaneas.get(clave)
+            if actual is None or actual.version != version:
+                actual = InstantaneaResultados(
+                    version, self.actualizado_en, self.motor.num_equipos(),
+                    self.motor.top(self.top_n, peso_docente, peso_estudiante),
+                )
+                self._instantaneas[clave] = actual
+            return actual
+
+
+@st.cache_resource(show_spinner=False)
+def _sondeo_compartido(clave, intervalo, _repositorio, _motor):
+    return SondeoResultados(_repositorio, _motor, intervalo)
+
+
+def obtener_sondeo_resultados(secrets, intervalo=10):
+    """Devuelve el sondeo de resultados del proceso (uno por almacenamiento e intervalo)."""
+    return _sondeo_compartido(
+        _clave_almacenamiento(secrets), intervalo, obtener_repositorio(secrets), obtener_motor_puntajes(secrets)
     )
-    gc = gspread.authorize(credentials)
 
-    # Abrir el spreadsheet por ID
-    sh = gc.open_by_key(secrets["spreadsheet"]["id"])
 
-    # Abrir hoja específica
-    ws = sh.worksheet("Respuestas de formulario 1")
+# ======================================================
+# 🔹 CÓDIGOS QR
+# ======================================================
 
-    # Obtener todos los registros y convertir a DataFrame
-    data = ws.get_all_records()
-    df = pd.DataFrame(data)
+def clave_qr(secrets):
+    """
+    Clave para firmar los enlaces QR: `[qr] clave` en secrets o, si no existe,
+    una derivada de la llave privada de la cuenta de servicio. Debe ser estable
+    entre reinicios para que los QR impresos sigan siendo válidos.
+    """
+    clave = secrets.get("qr", {}).get("clave")
+    if clave:
+        return str(clave).encode()
+    return hashlib.sha256(b"qr-equipos:" + str(secrets["gcp"]["private_key"]).encode()).digest()
 
-    # Limpiar nombres de columna
-    df.columns = df.columns.str.strip()
 
-    # Renombrar columnas para que coincidan con el dashboard
-    df.rename(columns={
-        'Inscripción Participantes': 'Participantes',
-        'Id_equipo (Respuestas de formulario 1)': 'Id_equipo',
-        'Nombre del Equipo': 'Equipo'
-    }, inplace=True)
+def firmar_equipo(clave, equipo_id):
+    """Firma HMAC-SHA256 (truncada a 128 bits, base64 url) del Id_equipo."""
+    digest = hmac.new(clave, str(equipo_id).strip().encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+
+def verificar_firma_equipo(clave, equipo_id, firma):
+    if not equipo_id or not firma:
+        return False
+    return hmac.compare_digest(firmar_equipo(clave, equipo_id), str(firma))
+
+
+def enlace_votacion(url_base, clave, equipo_id):
+    """Enlace de votación firmado: `<url_base>?equipo=<ID>&firma=<HMAC>`."""
+    parametros = urlencode({"equipo": str(equipo_id).strip(), "firma": firmar_equipo(clave, equipo_id)})
+    return f"{url_base.rstrip('/')}/?{parametros}"
+
+
+def generar_qr_equipos(df_equipos, url_base, clave):
+    """
+    Genera en lote los QR firmados de todos los equipos.
+
+    :param df_equipos: inscripciones normalizadas (columnas Id_equipo y Equipo)
+    :param url_base: URL pública de la app
+    :param clave: clave de firma (ver `clave_qr`)
+    :return: bytes de un .zip con un PNG por equipo y un enlaces.csv
+    """
+    equipos = df_equipos[["Id_equipo", "Equipo"]].astype(str).drop_duplicates("Id_equipo")
+    buffer = io.BytesIO()
+    enlaces = []
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archivo:
+        for equipo_id, nombre in equipos.itertuples(index=False):
+            enlace = enlace_votacion(url_base, clave, equipo_id)
+            imagen = qrcode.make(enlace)
+            png = io.BytesIO()
+            imagen.save(png, format="PNG")
+            nombre_archivo = re.sub(r"[^\w.-]+", "_", equipo_id.strip()) or "equipo"
+            archivo.writestr(f"qr/{nombre_archivo}.png", png.getvalue())
+            enlaces.append({"Id_equipo": equipo_id, "Equipo": nombre, "Enlace": enlace})
+        archivo.writestr("enlaces.csv", pd.DataFrame(enlaces).to_csv(index=False))
+    return buffer.getvalue()
+
+
+# ======================================================
+# 🔹 REPORTES
+# ======================================================
+
+# Columnas de cada reporte con su tipo de exportación ("texto", "entero", "decimal" o "fecha")
+REPORTES = {
+    "Inscripciones": {c: "texto" for c in COLUMNAS_INSCRIPCIONES},
+    "Votos": {
+        **{c: "texto" for c in COLUMNAS_VOTACIONES},
+        "Fecha": "fecha",
+        "Puntaje_Total": "entero",
+        **{c: "entero" for c in CRITERIOS},
+    },
+    "Ranking final": {
+        "Puesto": "entero",
+        "Id_equipo": "texto",
+        "Docente": "texto",
+        "Puntaje_Total": "decimal",
+        "Votos docentes": "entero",
+        "Votos estudiantes": "entero",
+        **{c: "decimal" for c in CRITERIOS},
+    },
+}
+
+FORMATOS_REPORTE = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def filas_ranking(secrets, docente=None, equipo=None, peso_docente=0.5, peso_estudiante=0.5):
+    """
+    Ranking final con la ponderación del tablero, fila por fila (en el orden de
+    REPORTES["Ranking final"]). Con filtros, cada equipo conserva su puesto general.
+    """
+    tensor = obtener_sondeo_resultados(secrets).motor.tensor()
+    docentes = obtener_registro_equipos(secrets).docente_por_equipo
+    escenario = Escenario("Ranking", "suma", (peso_docente, peso_estudiante), (1.0,) * len(CRITERIOS))
+    puntajes, orden = tensor.clasificar([escenario])
+    for puesto, i in enumerate(orden[0], start=1):
+        equipo_id = str(tensor.equipos[i])
+        docente_equipo = docentes.get(equipo_id, "")
+        if (equipo is not None and equipo_id != equipo) or (docente is not None and docente_equipo != docente):
+            continue
+        votos = tensor.votos[i]
+        promedios = tensor.sumas[i].sum(axis=0) / max(votos.sum(), 1)
+        yield [puesto, equipo_id, docente_equipo, puntajes[i, 0], *votos, *promedios]
 
+
+def lotes_reporte(secrets, reporte, docente=None, equipo=None, tamano_lote=5000):
+    """
+    Lotes de filas de un reporte, con los filtros aplicados al leer del almacenamiento.
+
+    :param reporte: clave de REPORTES
+    :return: iterador de listas de filas
+    """
+    if reporte == "Inscripciones":
+        return obtener_repositorio(secrets).iterar_inscripciones(docente, equipo, tamano_lote)
+    if reporte == "Votos":
+        return obtener_repositorio(secrets).iterar_votos(docente, equipo, tamano_lote)
+    if reporte == "Ranking final":
+        return en_lotes(filas_ranking(secrets, docente, equipo), tamano_lote)
+    raise ValueError(f"Reporte desconocido: {reporte}")
+
+
+def lote_reporte(tipos, filas):
+    """DataFrame de un lote con los tipos de exportación (iguales en todos los lotes de un reporte)."""
+    df = pd.DataFrame(filas, columns=list(tipos))
+    for columna, tipo in tipos.items():
+        serie = df[columna]
+        if tipo == "entero":
+            df[columna] = pd.to_numeric(serie, errors="coerce").round().astype("Int64")
+        elif tipo == "decimal":
+            df[columna] = pd.to_numeric(serie, errors="coerce").astype("float64")
+        elif tipo == "fecha":
+            df[columna] = _columna_fecha(serie.astype(str)).astype("datetime64[us]")
+        else:
+            df[columna] = serie.where(serie.notna(), "").astype(str)
     return df
 
 
+def escribir_reporte(tipos, lotes, formato, destino, titulo="Reporte"):
+    """
+    Escribe un reporte lote a lote en `destino` (archivo binario abierto), sin
+    tener en memoria más de un lote: el CSV se va escribiendo, Excel usa el
+    modo `write_only` de openpyxl y Parquet escribe un grupo de filas por lote.
+    openpyxl y pyarrow se importan solo al exportar en su formato.
+
+    :param tipos: columnas del reporte con su tipo (ver REPORTES)
+    :param formato: clave de FORMATOS_REPORTE
+    :return: número de filas escritas
+    """
+    filas = 0
+    if formato == "CSV":
+        # utf-8 con BOM para que Excel abra bien las tildes
+        texto = io.TextIOWrapper(destino, encoding="utf-8-sig", newline="")
+        encabezado = True
+        for lote in lotes:
+            df = lote_reporte(tipos, lote)
+            df.to_csv(texto, header=encabezado, index=False)
+            encabezado = False
+            filas += len(df)
+        if encabezado:
+            lote_reporte(tipos, []).to_csv(texto, index=False)
+        texto.flush()
+        texto.detach()
+    elif formato == "Excel":
+        from openpyxl import Workbook
+
+        libro = Workbook(write_only=True)
+        hoja = libro.create_sheet(title=titulo[:31])
+        hoja.append(list(tipos))
+        for lote in lotes:
+            df = lote_reporte(tipos, lote).astype(object)
+            for fila in df.where(df.notna(), None).itertuples(index=False, name=None):
+                hoja.append(fila)
+            filas += len(df)
+        libro.save(destino)
+    elif formato == "Parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tipos_arrow = {"texto": pa.string(), "entero": pa.int64(), "decimal": pa.float64(), "fecha": pa.timestamp("us")}
+        esquema = pa.schema([(c, tipos_arrow[t]) for c, t in tipos.items()])
+        with pq.ParquetWriter(destino, esquema) as escritor:
+            for lote in lotes:
+                df = lote_reporte(tipos, lote)
+                escritor.write_table(pa.Table.from_pandas(df, schema=esquema, preserve_index=False))
+                filas += len(df)
+    else:
+        raise ValueError(f"Formato desconocido: {formato}")
+    return filas
+
+
 # ======================================================
 # 🔹 MÓDULOS
 # ======================================================
@@ -170,7 +3545,6 @@ def init_session_state():
         "correo_docente": "",
         "correo_valido": False,
         "codigo_validado": False,
-        "df_docentes": None
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -178,13 +3552,56 @@ def init_session_state():
 
 
 def reset_role():
-    for k in ["rol", "rol_seleccionado", "validando_docente", "correo_docente", "correo_valido", "codigo_validado",
-              "df_docentes"]:
+    for k in ["rol", "rol_seleccionado", "validando_docente", "correo_docente", "correo_valido", "codigo_validado"]:
         if k in st.session_state:
             del st.session_state[k]
     st.rerun()
 
 
+def formatear_edad(segundos):
+    """Texto corto para la antigüedad de unos datos, p. ej. "45 s", "3 min" o "1 h 5 min"."""
+    segundos = int(segundos or 0)
+    if segundos < 60:
+        return f"{segundos} s"
+    if segundos < 3600:
+        return f"{segundos // 60} min"
+    return f"{segundos // 3600} h {segundos % 3600 // 60} min"
+
+
+@contextmanager
+def turno_admision(control):
+    """
+    Espera turno en la fila de admisión mostrando la posición y la espera
+    estimada; libera el turno al salir (también si la sesión se cierra o
+    se re-ejecuta mientras espera).
+
+    :raises ColaLlena: si la fila está completa
+    """
+    ticket = control.solicitar()
+    aviso = st.empty()
+    try:
+        while not control.esperar(ticket, 1.0):
+            posicion, espera = control.posicion(ticket)
+            aviso.info(f"⏳ Hay muchas personas votando en este momento. Estás en el puesto **{posicion}** "
+                       f"de la fila; tiempo estimado: {formatear_edad(max(espera, 1))}.")
+        aviso.empty()
+        yield
+    finally:
+        control.liberar(ticket)
+
+
+def render_antiguedad_datos(hoja):
+    """Antigüedad de los datos de una hoja, con aviso si Google no responde y se sirve la copia anterior."""
+    edad, error = obtener_repositorio(st.secrets).estado_datos(hoja)
+    if edad is None:
+        return
+    if error is not None:
+        st.warning(f"⚠️ Google Sheets no responde; se muestran los datos de hace {formatear_edad(edad)}. "
+                   "Se actualizarán solos cuando vuelva el servicio.")
+    else:
+        st.caption(f"🕒 Datos actualizados hace {formatear_edad(edad)}")
+
+
 def render_student_ui():
     st.header("🎓 Panel - Estudiante")
     st.markdown("¡Bienvenido estudiante! Revisa el menu lateral izquierdo:")
@@ -247,14 +3664,226 @@ def render_student_ui():
         reset_role()
 
 
+def render_metricas_api():
+    """Panel de llamadas a la API de Google por módulo, con exportación para Prometheus."""
+    metricas = obtener_metricas_api()
+    st.subheader("📡 Uso de la API de Google Sheets")
+    resumen = metricas.resumen()
+    if resumen.empty:
+        st.info("Aún no se han registrado llamadas a la API en este proceso.")
+        return
+
+    activos, en_fila = obtener_control_admision(st.secrets).estado()
+    st.caption(f"Votación: {activos} turnos activos, {en_fila} sesiones en fila.")
+    if "gcp" in st.secrets:
+        circuito = obtener_conexion(st.secrets).planificador.circuito
+        if circuito.estado != circuito.CERRADO:
+            st.warning(f"🔌 Circuito de la API {circuito.estado}: las llamadas se rechazan sin esperar a Google "
+                       f"(próxima prueba en {circuito.reintento_en():.0f} s).")
+        st.caption(f"Aperturas del circuito en este proceso: {circuito.aperturas}")
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Llamadas", int(resumen["Llamadas"].sum()))
+    col2.metric("Errores", int(resumen["Errores"].sum()))
+    col3.metric("Módulos", resumen["Módulo"].nunique())
+
+    chart = alt.Chart(resumen).mark_bar().encode(
+        x=alt.X("sum(Llamadas):Q", title="Llamadas"),
+        y=alt.Y("Módulo:N", sort="-x", title=None),
+        color=alt.Color("Operación:N"),
+        tooltip=["Módulo", "Operación", "Llamadas", "Errores", "Latencia media (ms)"]
+    )
+    st.altair_chart(chart, use_container_width=True)
+    st.dataframe(resumen, use_container_width=True, hide_index=True)
+
+    texto = metricas.exportar_prometheus()
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        "⬇️ Exportar (Prometheus)", texto, file_name="metricas_sheets.prom", mime="text/plain"
+    )
+    if col2.button("🔄 Reiniciar métricas"):
+        metricas.reiniciar()
+        st.rerun()
+    with st.expander("Ver exportación en texto"):
+        st.code(texto, language="text")
+
+
+def render_reportes():
+    """Descarga de inscripciones, votos y ranking final, generados por lotes desde el almacenamiento."""
+    st.subheader("📥 Reportes del concurso")
+    col1, col2 = st.columns(2)
+    reporte = col1.selectbox("Reporte:", list(REPORTES))
+    formato = col2.selectbox("Formato:", list(FORMATOS_REPORTE))
+    try:
+        docentes = [str(d) for d in obtener_registro_equipos(st.secrets).docentes]
+    except Exception as e:
+        st.warning(f"⚠️ No se pudo cargar la lista de docentes: {e}")
+        docentes = []
+    col1, col2 = st.columns(2)
+    docente = col1.selectbox("Docente:", ["Todos"] + docentes)
+    equipo = col2.text_input("Código del equipo (opcional):").strip()
+
+    if st.button("Generar reporte"):
+        extension, mime = FORMATOS_REPORTE[formato]
+        with tempfile.TemporaryFile() as archivo:
+            try:
+                with st.spinner("Generando reporte..."):
+                    lotes = lotes_reporte(
+                        st.secrets, reporte, None if docente == "Todos" else docente, equipo or None
+                    )
+                    filas = escribir_reporte(REPORTES[reporte], lotes, formato, archivo, titulo=reporte)
+            except ImportError as e:
+                st.error(f"❌ Para exportar en {formato} falta instalar `{e.name}` (ver requirements.txt).")
+                return
+            except Exception as e:
+                st.error(f"⚠️ Error al generar el reporte: {e}")
+                return
+            archivo.seek(0)
+            st.success(f"✅ Reporte listo: {filas} filas.")
+            nombre = f"{reporte.lower().replace(' ', '_')}.{extension}"
+            st.download_button("⬇️ Descargar reporte", archivo.read(), file_name=nombre, mime=mime)
+
+
+def render_codigos_qr():
+    """Generación en lote de los QR firmados de votación para todos los equipos."""
+    st.subheader("🔳 Códigos QR de votación")
+    st.caption("Cada QR lleva el equipo firmado: quien lo escanee vota sin que la app consulte las inscripciones.")
+    url_base = st.text_input("URL pública de la app:", value=st.secrets.get("qr", {}).get("url_base", ""))
+    if st.button("Generar QR de todos los equipos"):
+        if not url_base:
+            st.error("❌ Ingresa la URL pública de la app.")
+            return
+        try:
+            registro = obtener_registro_equipos(st.secrets)
+            contenido = generar_qr_equipos(registro.inscripciones, url_base, clave_qr(st.secrets))
+        except Exception as e:
+            st.error(f"⚠️ Error al generar los QR: {e}")
+            return
+        st.success(f"✅ QR generados para {len(registro)} equipos.")
+        st.download_button("⬇️ Descargar QR (.zip)", contenido, file_name="qr_equipos.zip", mime="application/zip")
+
+
+ESCENARIOS_INICIALES = [
+    ("Tablero 50/50", "suma", 0.5, 0.5),
+    ("Solo docentes", "suma", 1.0, 0.0),
+    ("Solo estudiantes", "suma", 0.0, 1.0),
+    ("Promedio 50/50", "promedio", 0.5, 0.5),
+    ("Puntaje z 50/50", "z", 0.5, 0.5),
+]
+
+
+def escenarios_desde_tabla(tabla):
+    """
+    Convierte las filas del editor de escenarios en Escenario.
+    Omite filas sin nombre o modo; los pesos vacíos valen 0 por rol y 1 por criterio.
+    """
+    def peso(fila, columna, defecto):
+        return defecto if pd.isna(fila.get(columna)) else float(fila[columna])
+
+    modos = {etiqueta: modo for modo, etiqueta in MODOS_PUNTAJE.items()}
+    escenarios, nombres = [], set()
+    for fila in tabla.to_dict("records"):
+        nombre, modo = fila.get("Escenario"), modos.get(fila.get("Modo"))
+        if not nombre or pd.isna(nombre) or modo is None:
+            continue
+        nombre, n = str(nombre), 2
+        while nombre in nombres:
+            nombre, n = f"{fila['Escenario']} ({n})", n + 1
+        nombres.add(nombre)
+        escenarios.append(Escenario(
+            nombre, modo,
+            (peso(fila, "Peso docentes", 0.0), peso(fila, "Peso estudiantes", 0.0)),
+            tuple(peso(fila, c, 1.0) for c in CRITERIOS),
+        ))
+    return escenarios
+
+
+def barrido_peso_docente(modo, pasos):
+    """Escenarios con el peso de los docentes de 0 a 1 (y el de estudiantes complementario)."""
+    return [
+        Escenario(f"{p:.2f}", modo, (p, 1.0 - p), (1.0,) * len(CRITERIOS))
+        for p in np.linspace(0.0, 1.0, pasos)
+    ]
+
+
+def render_explorador_ponderaciones():
+    """Comparación del ranking con varias ponderaciones y normalizaciones de los votos."""
+    st.subheader("⚖️ Explorador de ponderaciones")
+    st.caption("Compara cómo cambia el ranking según el peso de cada rol y criterio y la forma de normalizar "
+               "los votos. El tablero público no cambia.")
+    try:
+        sondeo = obtener_sondeo_resultados(st.secrets)
+        tensor = sondeo.motor.tensor()
+    except Exception as e:
+        st.error(f"⚠️ Error al cargar los votos: {e}")
+        return
+    if len(tensor) == 0:
+        st.info("Aún no hay votos registrados.")
+        return
+    if sondeo.actualizado_en is not None:
+        st.caption(f"Votos leídos a las {sondeo.actualizado_en:%H:%M:%S} · {len(tensor)} equipos.")
+
+    iniciales = pd.DataFrame(
+        [(nombre, MODOS_PUNTAJE[modo], doc, est) + (1.0,) * len(CRITERIOS)
+         for nombre, modo, doc, est in ESCENARIOS_INICIALES],
+        columns=["Escenario", "Modo", "Peso docentes", "Peso estudiantes"] + CRITERIOS,
+    )
+    tabla = st.data_editor(
+        iniciales, num_rows="dynamic", hide_index=True, use_container_width=True, key="escenarios_ponderacion",
+        column_config={"Modo": st.column_config.SelectboxColumn(options=list(MODOS_PUNTAJE.values()), required=True)},
+    )
+    escenarios = escenarios_desde_tabla(tabla)
+    if not escenarios:
+        st.info("Agrega al menos un escenario con nombre y modo.")
+        return
+
+    inicio = time.perf_counter()
+    puestos, puntajes = tensor.tablas(escenarios)
+    st.caption(f"{len(escenarios)} escenarios evaluados en {(time.perf_counter() - inicio) * 1000:.1f} ms.")
+    mostrar = st.number_input("Equipos a mostrar:", 1, len(tensor), min(20, len(tensor)))
+    vista = puestos.sort_values(puestos.columns[0], kind="stable").head(int(mostrar))
+    st.dataframe(vista, use_container_width=True)
+    with st.expander("Ver puntajes"):
+        st.dataframe(puntajes.loc[vista.index].round(3), use_container_width=True)
+
+    st.markdown("#### Barrido del peso de los docentes")
+    col1, col2 = st.columns(2)
+    modo = col1.selectbox("Modo de puntaje:", list(MODOS_PUNTAJE), format_func=MODOS_PUNTAJE.get)
+    pasos = col2.slider("Escenarios del barrido:", 3, 101, 51)
+    barrido = barrido_peso_docente(modo, pasos)
+    inicio = time.perf_counter()
+    puestos_barrido, _ = tensor.tablas(barrido)
+    st.caption(f"{len(barrido)} escenarios evaluados en {(time.perf_counter() - inicio) * 1000:.1f} ms; "
+               "se grafican los equipos que llegan al top 3 en alguno.")
+
+    destacados = puestos_barrido[(puestos_barrido <= 3).any(axis=1)]
+    largo = destacados.reset_index().melt(id_vars="Id_equipo", var_name="Peso docentes", value_name="Puesto")
+    largo["Peso docentes"] = largo["Peso docentes"].astype(float)
+    chart = alt.Chart(largo).mark_line(interpolate="step-after").encode(
+        x=alt.X("Peso docentes:Q", title="Peso de los docentes"),
+        y=alt.Y("Puesto:Q", scale=alt.Scale(reverse=True), title="Puesto"),
+        color=alt.Color("Id_equipo:N"),
+        tooltip=["Id_equipo", "Peso docentes", "Puesto"]
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+
 def render_docente_ui():
     st.header("👨‍🏫 Panel - Docente")
     st.markdown("Bienvenido docente. Aquí están las herramientas del docente revisa el menu lateral izquierdo:")
-    opcion = st.radio("Selecciona una opción:", ["Validar inscripciones", "Reportes", "Mi perfil", "Ayuda"])
+    opcion = st.radio(
+        "Selecciona una opción:", ["Validar inscripciones", "Reportes", "Ponderaciones", "Códigos QR", "Mi perfil", "Ayuda"]
+    )
     if opcion == "Validar inscripciones":
         st.write("Lista de inscripciones pendientes para validar...")
+    elif opcion == "Ponderaciones":
+        render_explorador_ponderaciones()
+    elif opcion == "Códigos QR":
+        render_codigos_qr()
     elif opcion == "Reportes":
-        st.write("Descargar reportes y métricas del concurso...")
+        render_reportes()
+        st.markdown("---")
+        render_metricas_api()
     elif opcion == "Mi perfil":
         st.write(f"Correo: {st.session_state.get('correo_docente')}")
     else:
@@ -264,6 +3893,7 @@ def render_docente_ui():
         reset_role()
 
 
+@atribuir_modulo("modulo_home")
 def modulo_home():
     init_session_state()
 
@@ -325,11 +3955,10 @@ def modulo_home():
 
         # Acción: validar correo
         if validar_correo:
-            df_docentes = cargar_docentes(st.secrets)
-            if correo_input in df_docentes["Correo"].values:
+            indice_docentes = obtener_indice_docentes(st.secrets)
+            if indice_docentes.contiene(correo_input):
                 st.session_state["correo_docente"] = correo_input
                 st.session_state["correo_valido"] = True
-                st.session_state["df_docentes"] = df_docentes
                 st.success("✅ Correo verificado. Ingresa tu código de validación. 👨‍🏫")
             else:
                 st.error("❌ Tu correo no está autorizado como docente.")
@@ -354,11 +3983,10 @@ def modulo_home():
                 st.rerun()
 
             if validar_codigo and not st.session_state["codigo_validado"]:
-                df_docentes = st.session_state["df_docentes"]
+                indice_docentes = obtener_indice_docentes(st.secrets)
                 correo = st.session_state["correo_docente"]
-                codigo_real = df_docentes.loc[df_docentes["Correo"] == correo, "Codigo"].values[0]
 
-                if str(codigo_input).strip() == str(codigo_real).strip():
+                if indice_docentes.verificar(correo, codigo_input):
                     st.session_state["rol_seleccionado"] = True
                     st.session_state["rol"] = "Docente"
                     st.session_state["validando_docente"] = False
@@ -381,6 +4009,7 @@ def modulo_home():
             reset_role()
 
 
+@atribuir_modulo("modulo_inscripcion")
 def modulo_inscripcion():
     st.header("📝 Formulario de Inscripción")
 
@@ -410,72 +4039,81 @@ def modulo_inscripcion():
     )
 
 
+@atribuir_modulo("modulo_dashboard")
 def modulo_dashboard():
     st.header("📊 Dashboard de Inscripciones")
 
-    # Cargar solo la hoja necesaria
+    # Registro compartido: solo se reconstruye cuando cambia la hoja de inscripciones.
+    # Si Google falla y ya hubo una carga, se sirve la anterior con su antigüedad.
     try:
-        df = cargar_respuestas_formulario(st.secrets)
+        registro = obtener_registro_equipos(st.secrets)
+    except CuotaAgotada:
+        st.warning("⏳ Hay mucha demanda en este momento; el dashboard se actualizará en unos segundos.")
+        return
+    except CircuitoAbierto:
+        st.warning("🔌 Google Sheets no responde en este momento; intenta de nuevo en unos segundos.")
+        return
     except Exception as e:
         st.error(f"❌ Error al cargar la hoja: {e}")
-        st.stop()
+        return
+    render_antiguedad_datos("Respuestas de formulario 1")
 
+    df = registro.inscripciones
     if df.empty:
         st.warning("⚠️ No hay inscripciones registradas todavía.")
         return
 
     # Verificar que existan columnas necesarias
-    required_cols = ['Docente', 'Participantes', 'Id_equipo', 'Equipo']
-    for col in required_cols:
-        if col not in df.columns:
-            st.error(f"❌ La columna '{col}' no existe en el DataFrame.")
-            st.write("Columnas disponibles:", df.columns.tolist())
-            st.stop()
-
-    # Selector de docente en sidebar
-    docentes = df['Docente'].unique()
-    docente_sel = st.sidebar.selectbox("📌 Filtrar por docente", ["Todos"] + list(docentes))
-    df_filtrado = df if docente_sel == "Todos" else df[df['Docente'] == docente_sel]
+    for col in registro.columnas_faltantes:
+        st.error(f"❌ La columna '{col}' no existe en el DataFrame.")
+        st.write("Columnas disponibles:", df.columns.tolist())
+        st.stop()
 
-    # Calcular cantidad de estudiantes
-    df_filtrado['Cantidad de Estudiantes'] = df_filtrado['Participantes'].apply(contar_participantes)
+    # Selector de docente en sidebar: cada filtro es una búsqueda en los agregados del registro
+    docente_sel = st.sidebar.selectbox("📌 Filtrar por docente", ["Todos"] + registro.docentes)
+    filtro = None if docente_sel == "Todos" else docente_sel
+    resumen = registro.resumen(filtro)
 
     # Métricas principales
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("📝 Inscripciones", len(df_filtrado))
+        st.metric("📝 Inscripciones", resumen.inscripciones)
     with col2:
-        st.metric("👥 Equipos", df_filtrado['Id_equipo'].nunique())
+        st.metric("👥 Equipos", resumen.equipos)
     with col3:
-        st.metric("🎓 Estudiantes", df_filtrado['Cantidad de Estudiantes'].sum())
+        st.metric("🎓 Estudiantes", resumen.estudiantes)
 
     # Gráfico de inscripciones por docente
     st.subheader("📈 Inscripciones por Docente")
-    resumen = df_filtrado.groupby("Docente")['Cantidad de Estudiantes'].sum().reset_index()
-    chart = (
-        alt.Chart(resumen)
-        .mark_bar(size=35, cornerRadiusTopLeft=8, cornerRadiusTopRight=8)
-        .encode(
-            x=alt.X('Docente:N', sort='-y', title="Docente"),
-            y=alt.Y('Cantidad de Estudiantes:Q', title="Estudiantes"),
-            color=alt.value('#1B396A'),
-            tooltip=['Docente', 'Cantidad de Estudiantes']
-        )
-        .properties(height=350)
-    )
-    st.altair_chart(chart, use_container_width=True)
+    st.vega_lite_chart(registro.spec_grafico_docentes(filtro), use_container_width=True)
 
     # Detalle de inscripciones
     with st.expander("📋 Ver detalle de inscripciones", expanded=False):
-        st.dataframe(df_filtrado[['Equipo', 'Docente', 'Cantidad de Estudiantes', 'Id_equipo']])
+        st.dataframe(registro.detalle(filtro))
 
-        
+
+@atribuir_modulo("modulo_votacion")
 def modulo_votacion():
     st.header("🗳 Votación de Equipos")
 
+    # Tras cada presentación todo el público escanea el QR a la vez: la parte que
+    # toca el almacenamiento se atiende por turnos, en orden de llegada
+    try:
+        with turno_admision(obtener_control_admision(st.secrets)):
+            pasos_votacion()
+    except ColaLlena as e:
+        st.warning(f"⏳ Hay demasiadas personas votando en este momento; intenta de nuevo en "
+                   f"{formatear_edad(max(e.espera_estimada, 5))}.")
+
+
+def pasos_votacion():
     # ================= Parámetros QR =================
+    # Inscripciones y votos en una sola llamada (solo descarga lo que no esté en caché)
+    precargar_hojas(st.secrets, ["Respuestas de formulario 1", "Votaciones"])
+
     params = st.query_params
-    equipo_qr = params.get("equipo", [None])[0]
+    equipo_qr = params.get("equipo")
+    firma_qr = params.get("firma")
 
     # Inicializar estado de sesión
     if "validado_voto" not in st.session_state:
@@ -496,14 +4134,15 @@ def modulo_votacion():
         equipo_id = st.text_input("🏷️ Código del equipo a evaluar:", value=equipo_qr or "")
 
         if st.button("Continuar ▶️"):
+            equipo_id = equipo_id.strip()
             if not equipo_id or (rol != "Docente" and not correo):
                 st.error("❌ Debes ingresar tu correo y el código del equipo.")
                 return
 
             try:
-                # Cargar inscripciones
-                df_insc = cargar_respuestas_formulario(st.secrets)
-                if equipo_id not in df_insc["Id_equipo"].astype(str).tolist():
+                # Un enlace QR firmado ya prueba que el equipo existe; solo el código escrito a mano se consulta
+                firmado = equipo_id == equipo_qr and verificar_firma_equipo(clave_qr(st.secrets), equipo_id, firma_qr)
+                if not firmado and not obtener_registro_equipos(st.secrets).existe(equipo_id):
                     st.error("❌ El código del equipo no existe.")
                     return
 
@@ -527,21 +4166,9 @@ def modulo_votacion():
         st.markdown(f"<h4 style='color:#1B396A;'>📋 Evaluación del Proyecto ({rol})</h4>", unsafe_allow_html=True)
 
         try:
-            # Conectar a hoja de votaciones
-            credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["gcp"], scopes=["https://www.googleapis.com/auth/spreadsheets"]
-            )
-            gc = gspread.authorize(credentials)
-            sh = gc.open_by_key(st.secrets["spreadsheet"]["id"])
-            ws_votos = sh.worksheet("Votaciones")
-
             # Revisar si ya votó este correo por este equipo
-            votos = pd.DataFrame(ws_votos.get_all_records())
-            ya_voto = False
-            if not votos.empty:
-                ya_voto = not votos[
-                    (votos["Correo"] == correo) & (votos["Id_equipo"] == equipo_id)
-                ].empty
+            indice_votos = obtener_indice_votos(st.secrets)
+            ya_voto = indice_votos.ya_voto(correo, equipo_id)
 
             if ya_voto:
                 st.warning(f"⚠️ Ya registraste un voto para el equipo **{equipo_id}**.")
@@ -552,58 +4179,94 @@ def modulo_votacion():
                     st.rerun()
                 return  # Evitar que aparezca el formulario
 
-            # Formularios según rol
-            if rol == "Docente":
-                col1, col2, col3 = st.columns(3)
-                with col1: rigor = st.slider("Rigor técnico", 1, 5, 3)
-                with col2: viabilidad = st.slider("Viabilidad financiera", 1, 5, 3)
-                with col3: innovacion = st.slider("Innovación", 1, 5, 3)
-                puntaje_total = rigor + viabilidad + innovacion
-            else:
-                col1, col2, col3 = st.columns(3)
-                with col1: creatividad = st.slider("Creatividad", 1, 5, 3)
-                with col2: claridad = st.slider("Claridad de la presentación", 1, 5, 3)
-                with col3: impacto = st.slider("Impacto percibido", 1, 5, 3)
-                puntaje_total = creatividad + claridad + impacto
-
-            st.markdown(f"<div class='score-box'>🧮 Puntaje total: <b>{puntaje_total}</b></div>", unsafe_allow_html=True)
-
-            # Botón de envío
-            if st.button("✅ Enviar voto"):
-                with st.spinner("🎯 Enviando tu voto..."):
-                    time.sleep(1.8)
-                    try:
-                        # --- Determinar los tres criterios según el rol ---
-                        if rol == "Docente":
-                            criterio1 = rigor
-                            criterio2 = viabilidad
-                            criterio3 = innovacion
-                        else:
-                            criterio1 = creatividad
-                            criterio2 = claridad
-                            criterio3 = impacto
-                            
-                        puntaje_total = criterio1 + criterio2 + criterio3
-
-                       # Registrar voto en la hoja, incluyendo correo
-                        registro = [str(datetime.now()), rol, correo, equipo_id, puntaje_total,criterio1,criterio2,criterio3]
-                        ws_votos.append_row(registro)
-                        st.success("✅ ¡Tu voto ha sido registrado!")
-                        st.balloons()
-
-                        if st.button("🔄 Votar por otro equipo"):
-                            st.session_state.validado_voto = False
-                            if "equipo_voto" in st.session_state:
-                                del st.session_state["equipo_voto"]
-                            st.rerun()
-
-                    except Exception as e:
-                        st.error(f"⚠️ Error al registrar el voto: {e}")
+            # Formulario aislado: mover un slider solo vuelve a ejecutar el fragmento
+            formulario_votacion(rol, correo, equipo_id, indice_votos)
         except Exception as e:
             st.error(f"⚠️ Error al cargar datos de votaciones: {e}")
 
+
+@st.fragment
+@atribuir_modulo("modulo_votacion")
+def formulario_votacion(rol, correo, equipo_id, indice_votos):
+    """
+    Formulario de evaluación según el rol. Se ejecuta como fragmento: los
+    sliders recalculan el puntaje localmente y solo "Enviar voto" escribe.
+    """
+    # Id del intento de voto: se fija al mostrar el formulario para este votante y
+    # equipo, se reutiliza en reenvíos y se descarta cuando el intento termina
+    clave_id = f"id_voto_{normalizar_correo(correo)}_{equipo_id}"
+    if clave_id not in st.session_state:
+        st.session_state[clave_id] = uuid.uuid4().hex
+    id_voto = st.session_state[clave_id]
+
+    # Formularios según rol
+    if rol == "Docente":
+        col1, col2, col3 = st.columns(3)
+        with col1: rigor = st.slider("Rigor técnico", 1, 5, 3)
+        with col2: viabilidad = st.slider("Viabilidad financiera", 1, 5, 3)
+        with col3: innovacion = st.slider("Innovación", 1, 5, 3)
+        puntaje_total = rigor + viabilidad + innovacion
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1: creatividad = st.slider("Creatividad", 1, 5, 3)
+        with col2: claridad = st.slider("Claridad de la presentación", 1, 5, 3)
+        with col3: impacto = st.slider("Impacto percibido", 1, 5, 3)
+        puntaje_total = creatividad + claridad + impacto
+
+    st.markdown(f"<div class='score-box'>🧮 Puntaje total: <b>{puntaje_total}</b></div>", unsafe_allow_html=True)
+
+    # Botón de envío
+    if st.button("✅ Enviar voto"):
+        with st.spinner("🎯 Enviando tu voto..."):
+            try:
+                # --- Determinar los tres criterios según el rol ---
+                if rol == "Docente":
+                    criterio1 = rigor
+                    criterio2 = viabilidad
+                    criterio3 = innovacion
+                else:
+                    criterio1 = creatividad
+                    criterio2 = claridad
+                    criterio3 = impacto
+                    
+                puntaje_total = criterio1 + criterio2 + criterio3
+
+                # Registrar voto en el almacenamiento (con Sheets, el diario local lo sube a la hoja)
+                registro = [str(datetime.now()), rol, correo, equipo_id, puntaje_total,criterio1,criterio2,criterio3,
+                            id_voto]
+                # El envío corre como re-ejecución del fragmento, fuera del turno tomado
+                # al cargar la página: la escritura pide su propio turno en la fila
+                try:
+                    with turno_admision(obtener_control_admision(st.secrets)):
+                        registrado_en, repetido = registrar_voto_idempotente(st.secrets, registro, indice_votos)
+                except ColaLlena as e:
+                    st.warning(f"⏳ Hay demasiadas personas votando en este momento; tu voto no se envió. "
+                               f"Intenta de nuevo en {formatear_edad(max(e.espera_estimada, 5))}.")
+                    return
+                except VotoDuplicado:
+                    st.session_state.pop(clave_id, None)
+                    st.warning(f"⚠️ Ya registraste un voto para el equipo **{equipo_id}**.")
+                    return
+                st.session_state.pop(clave_id, None)
+                if repetido:
+                    st.success(f"✅ Tu voto ya había quedado registrado ({registrado_en[:19]}).")
+                    return
+                st.success("✅ ¡Tu voto ha sido registrado!")
+                st.balloons()
+
+                if st.button("🔄 Votar por otro equipo"):
+                    st.session_state.validado_voto = False
+                    if "equipo_voto" in st.session_state:
+                        del st.session_state["equipo_voto"]
+                    st.rerun()
+
+            except Exception as e:
+                st.error(f"⚠️ Error al registrar el voto: {e}")
+
+
 # ================= Dashboard en tiempo real =================
 
+@atribuir_modulo("modulo_resultados")
 def modulo_resultados(peso_docente=0.5, peso_estudiante=0.5, refresh_interval=10):
     """
     Muestra los resultados en tiempo real de manera visual y atractiva.
@@ -613,42 +4276,40 @@ def modulo_resultados(peso_docente=0.5, peso_estudiante=0.5, refresh_interval=10
     """
     st.title("🏆 Resultados Concurso Analítica Financiera")
 
-    # Conectar a Google Sheets
+    # Un solo sondeo por proceso; cada sesión solo redibuja el fragmento del tablero
     try:
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp"], scopes=["https://www.googleapis.com/auth/spreadsheets"]
-        )
-        gc = gspread.authorize(credentials)
-        sh = gc.open_by_key(st.secrets["spreadsheet"]["id"])
-        ws_votos = sh.worksheet("Votaciones")
-        data_votos = pd.DataFrame(ws_votos.get_all_records())
+        sondeo = obtener_sondeo_resultados(st.secrets, refresh_interval)
     except Exception as e:
         st.error(f"⚠️ Error al cargar resultados: {e}")
         return
 
-    if data_votos.empty:
-        st.info("Aún no hay votos registrados.")
-        return
+    # Cada tic redibuja solo este fragmento desde la instantánea publicada (sin llamadas
+    # a la API; el ranking se recalcula una vez por versión). No puede omitir el dibujo
+    # cuando nada cambió: un fragmento borra los elementos que no vuelve a emitir
+    @st.fragment(run_every=refresh_interval)
+    @atribuir_modulo("modulo_resultados")
+    def tablero():
+        render_tablero_resultados(sondeo, peso_docente, peso_estudiante)
 
-    # Asegurar que los criterios sean numéricos
-    criterios = ["Criterio 1", "Criterio 2", "Criterio 3"]
-    for c in criterios:
-        data_votos[c] = pd.to_numeric(data_votos[c], errors="coerce").fillna(0)
+    tablero()
 
-    # Calcular puntaje ponderado
-    def calcular_total(row):
-        total = sum([row[c] for c in criterios])
-        return total * (peso_docente if row["Rol Votante"] == "Docente" else peso_estudiante)
+    st.markdown("---")
+    st.info(f"⏱ La tabla se actualizará automáticamente cada {refresh_interval} segundos.")
 
-    data_votos["Puntaje Ponderado"] = data_votos.apply(calcular_total, axis=1)
 
-    # Agrupar por equipo y calcular promedio por criterio
-    resultados = data_votos.groupby("Id_equipo").agg(
-        Puntaje_Total=pd.NamedAgg(column="Puntaje Ponderado", aggfunc="sum")
-    ).sort_values("Puntaje_Total", ascending=False).reset_index()
+def render_tablero_resultados(sondeo, peso_docente, peso_estudiante):
+    instantanea = sondeo.instantanea(peso_docente, peso_estudiante)
+    if instantanea.num_equipos == 0:
+        if sondeo.ultimo_error is not None:
+            st.error(f"⚠️ Error al cargar resultados: {sondeo.ultimo_error}")
+        else:
+            st.info("Aún no hay votos registrados.")
+        return
+    if sondeo.ultimo_error is not None and sondeo.actualizado_en is not None:
+        edad = (datetime.now() - sondeo.actualizado_en).total_seconds()
+        st.warning(f"⚠️ Sin conexión con Google Sheets; resultados de hace {formatear_edad(edad)}.")
 
-    promedio_criterios = data_votos.groupby("Id_equipo")[criterios].mean().reset_index()
-    resultados = resultados.merge(promedio_criterios, on="Id_equipo")
+    resultados = instantanea.resultados
 
     # ------------------- Top 3 Equipos -------------------
     st.subheader("🏅 Top 3 Equipos")
@@ -700,17 +4361,16 @@ def modulo_resultados(peso_docente=0.5, peso_estudiante=0.5, refresh_interval=10
         """, unsafe_allow_html=True)
         st.progress(min(row['Puntaje_Total']/15, 1.0))
 
-    # ------------------- Animaciones y actualización -------------------
-    if len(resultados) >= 30:
+    # ------------------- Animaciones -------------------
+    version_vista = st.session_state.get("version_resultados")
+    st.session_state["version_resultados"] = instantanea.version
+    if instantanea.num_equipos >= 30 and version_vista != instantanea.version:
         st.balloons()
 
-    st.markdown("---")
-    st.info(f"⏱ La tabla se actualizará automáticamente cada {refresh_interval} segundos.")
-
-    # Actualización automática
-    time.sleep(refresh_interval)
-    st.rerun()
+    if sondeo.actualizado_en is not None:
+        st.caption(f"Última actualización: {sondeo.actualizado_en:%H:%M:%S}")
 
+@atribuir_modulo("modulo_eventos")
 def modulo_eventos():
     st.markdown("<h2 style='color:#1B396A; text-align:center;'>📅 Próximo Evento</h2>", unsafe_allow_html=True)
     st.markdown("---")
@@ -0,0 +1,447 @@
+"""
+Pruebas de carga de la app con un Google Sheets simulado en memoria.
+
+Ejecuta los módulos reales de `app.py` (votación, dashboard y resultados)
+con `streamlit.testing.v1.AppTest`, simulando N sesiones concurrentes, y
+reemplaza gspread por un backend en memoria con latencia, cuotas por minuto
+y errores configurables. Al final reporta latencias p50/p95/p99,
+throughput y llamadas a la API de Sheets por acción de usuario.
+
+Uso:
+    python pruebas_carga.py --votantes 50 --docentes 5 --espectadores 20
+    python pruebas_carga.py --latencia 0.15 --cuota-lecturas 300 --errores 0.02
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import googleapiclient.discovery
+import gspread
+import numpy as np
+import pandas as pd
+import requests
+import streamlit as st
+from google.oauth2 import service_account
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.secrets import Secrets
+from streamlit import config
+from streamlit.testing.v1 import AppTest, app_test
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+ENCABEZADOS = {
+    "Docentes": ["Correo", "Codigo"],
+    "Respuestas de formulario 1": [
+        "Marca temporal", "Docente", "Inscripción Participantes",
+        "Id_equipo (Respuestas de formulario 1)", "Nombre del Equipo",
+    ],
+    "Votaciones": [
+        "Fecha", "Rol Votante", "Correo", "Id_equipo", "Puntaje_Total",
+        "Criterio 1", "Criterio 2", "Criterio 3", "Id_voto",
+    ],
+}
+
+
+# ======================================================
+# 🔹 SHEETS SIMULADO
+# ======================================================
+
+def _error_api(codigo, mensaje):
+    respuesta = requests.Response()
+    respuesta.status_code = codigo
+    respuesta._content = (
+        f'{{"error": {{"code": {codigo}, "message": "{mensaje}", "status": "SIMULADO"}}}}'.encode()
+    )
+    return gspread.exceptions.APIError(respuesta)
+
+
+class SheetsSimulado:
+    """
+    Backend en memoria compatible con la parte de gspread que usa la app.
+
+    :param latencia: segundos de espera por llamada (más un jitter de ±50 %)
+    :param cuota_lecturas: lecturas permitidas por minuto (None = sin límite)
+    :param cuota_escrituras: escrituras permitidas por minuto (None = sin límite)
+    :param tasa_errores: probabilidad de responder con un error 503
+    """
+
+    def __init__(self, latencia=0.1, cuota_lecturas=None, cuota_escrituras=None, tasa_errores=0.0):
+        self.latencia = latencia
+        self.cuotas = {"lectura": cuota_lecturas, "escritura": cuota_escrituras}
+        self.tasa_errores = tasa_errores
+        self.llamadas = Counter()
+        self.llamadas_por_sesion = Counter()
+        self.rechazos = Counter()
+        self._ventanas = {"lectura": deque(), "escritura": deque(), "drive": deque()}
+        self._lock = threading.Lock()
+        self.hojas = {nombre: [list(enc)] for nombre, enc in ENCABEZADOS.items()}
+        self.revision = 1
+        self._caida = (0.0, 0.0)
+
+    def poblar(self, equipos=40, docentes=8, votos=0):
+        """Llena las hojas con datos sintéticos."""
+        correos = [f"docente{i}@itm.edu.co" for i in range(docentes)]
+        self.hojas["Docentes"] += [[c, f"ITM{i:03d}"] for i, c in enumerate(correos)]
+        self.hojas["Respuestas de formulario 1"] += [
+            [str(pd.Timestamp.now()), f"Docente {i % docentes}", ", ".join(f"est{i}_{k}" for k in range(1 + i % 4)),
+             f"EQ{i:03d}", f"Equipo {i}"]
+            for i in range(equipos)
+        ]
+        for i in range(votos):
+            c = [random.randint(1, 5) for _ in range(3)]
+            rol = "Docente" if i % 5 == 0 else "Estudiante / Asistente"
+            self.hojas["Votaciones"].append(
+                [str(pd.Timestamp.now()), rol, f"previo{i}@itm.edu.co", f"EQ{i % equipos:03d}", sum(c), *c, f"p{i}"]
+            )
+        return self
+
+    def caer(self, desde, duracion):
+        """Simula una caída de Google: de `desde` a `desde + duracion` segundos, todo responde 503."""
+        inicio = time.monotonic() + desde
+        self._caida = (inicio, inicio + duracion)
+
+    def llamar(self, operacion, tipo):
+        """Registra una llamada, aplica latencia, cuota y errores inyectados."""
+        sesion = getattr(threading.current_thread(), "sesion_carga", "segundo plano")
+        with self._lock:
+            self.llamadas[operacion] += 1
+            self.llamadas_por_sesion[sesion] += 1
+            ahora = time.monotonic()
+            ventana = self._ventanas[tipo]
+            while ventana and ahora - ventana[0] > 60:
+                ventana.popleft()
+            cuota = self.cuotas.get(tipo)
+            if cuota is not None and len(ventana) >= cuota:
+                self.rechazos[operacion] += 1
+                raise _error_api(429, "Quota exceeded (simulado)")
+            ventana.append(ahora)
+        if self.latencia:
+            time.sleep(self.latencia * random.uniform(0.5, 1.5))
+        caido = self._caida[0] <= time.monotonic() < self._caida[1]
+        if caido or (self.tasa_errores and random.random() < self.tasa_errores):
+            with self._lock:
+                self.rechazos[operacion] += 1
+            raise _error_api(503, "Service unavailable (simulado)")
+
+    def total_llamadas(self, sesion=None):
+        with self._lock:
+            if sesion is not None:
+                return self.llamadas_por_sesion[sesion]
+            return sum(self.llamadas.values())
+
+    def instalar(self, drive=True):
+        """
+        Reemplaza la autorización de gspread (y la API de Drive, para la
+        detección de cambios) para que la app use este backend.
+        """
+        backend = self
+
+        def autorizar(credentials, *args, **kwargs):
+            backend.llamar("authorize", "lectura")
+            return ClienteSimulado(backend)
+
+        gspread.authorize = autorizar
+        service_account.Credentials.from_service_account_info = staticmethod(lambda info, scopes=None: object())
+        if drive:
+            googleapiclient.discovery.build = lambda *args, **kwargs: DriveSimulado(backend)
+
+
+class HojaSimulada:
+    def __init__(self, backend, titulo):
+        self.backend = backend
+        self.title = titulo
+        self.id = abs(hash(titulo)) % 10 ** 6
+
+    @property
+    def _filas(self):
+        return self.backend.hojas[self.title]
+
+    @property
+    def row_count(self):
+        return max(len(self._filas), 1000)
+
+    def get_all_values(self, *args, **kwargs):
+        self.backend.llamar("get_all_values", "lectura")
+        return [[str(v) for v in f] for f in self._filas]
+
+    def get_all_records(self, *args, **kwargs):
+        self.backend.llamar("get_all_records", "lectura")
+        encabezados, *filas = self._filas
+        return [dict(zip(encabezados, gspread.utils.numericise_all([str(v) for v in f]))) for f in filas]
+
+    def _rango(self, rango):
+        m = re.match(r"(?:'?[^!]*'?!)?[A-Z]+(\d*):[A-Z]+(\d*)$", rango or "A1:Z")
+        inicio = int(m.group(1) or 1)
+        fin = int(m.group(2) or len(self._filas))
+        return [[str(v) for v in f] for f in self._filas[inicio - 1:fin]]
+
+    def get(self, rango=None, *args, **kwargs):
+        self.backend.llamar("get", "lectura")
+        return self._rango(rango)
+
+    def col_values(self, columna, *args, **kwargs):
+        self.backend.llamar("col_values", "lectura")
+        return [str(f[columna - 1]) if len(f) >= columna else "" for f in self._filas]
+
+    def append_row(self, fila, *args, **kwargs):
+        self.backend.llamar("append_row", "escritura")
+        with self.backend._lock:
+            self._filas.append(list(fila))
+            self.backend.revision += 1
+
+    def append_rows(self, filas, *args, **kwargs):
+        self.backend.llamar("append_rows", "escritura")
+        with self.backend._lock:
+            self._filas.extend(list(f) for f in filas)
+            self.backend.revision += 1
+        return {}
+
+
+class SpreadsheetSimulado:
+    def __init__(self, backend, key):
+        self.backend = backend
+        self.id = key
+
+    def worksheet(self, nombre):
+        self.backend.llamar("worksheet", "lectura")
+        if nombre not in self.backend.hojas:
+            raise gspread.exceptions.WorksheetNotFound(nombre)
+        return HojaSimulada(self.backend, nombre)
+
+    @property
+    def sheet1(self):
+        return HojaSimulada(self.backend, next(iter(self.backend.hojas)))
+
+    def values_batch_get(self, rangos, params=None):
+        self.backend.llamar("values_batch_get", "lectura")
+        resultado = []
+        for rango in rangos:
+            nombre, _, celdas = rango.partition("!")
+            hoja = HojaSimulada(self.backend, nombre.strip("'").replace("''", "'"))
+            resultado.append({"range": rango, "values": hoja._rango(celdas or None)})
+        return {"spreadsheetId": self.id, "valueRanges": resultado}
+
+
+class ClienteSimulado:
+    def __init__(self, backend):
+        self.backend = backend
+        self.http_client = SimpleNamespace(session=requests.Session(), set_timeout=lambda timeout: None)
+
+    def open_by_key(self, key):
+        self.backend.llamar("open_by_key", "lectura")
+        return SpreadsheetSimulado(self.backend, key)
+
+
+class DriveSimulado:
+    """Lo mínimo de la API de Drive v3 que usa la app: files().get(...).execute()."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def files(self):
+        return self
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        return self
+
+    def execute(self):
+        self.backend.llamar("drive_files_get", "drive")
+        with self.backend._lock:
+            return {"version": str(self.backend.revision), "modifiedTime": ""}
+
+
+# ======================================================
+# 🔹 ESCENARIOS
+# ======================================================
+
+def preparar_streamlit(secrets):
+    """
+    Deja un Runtime simulado y unos secrets fijos para todo el proceso.
+
+    AppTest crea y descarta un Runtime global (y parchea la configuración)
+    en cada ejecución, lo que rompe las sesiones concurrentes; aquí todas
+    comparten el mismo, como en un servidor real.
+    """
+    config.set_option("global.appTest", True)
+    app_test.patch_config_options = lambda opciones: nullcontext()
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+
+
+def _sesion(modulo, estado=None):
+    """
+    AppTest que re-ejecuta app.py (como Streamlit) y llama al módulo indicado.
+    El hilo del script se marca con un id de sesión para atribuirle sus llamadas a la API.
+    """
+    codigo = (
+        "import runpy, threading\n"
+        "import streamlit as st\n"
+        "threading.current_thread().sesion_carga = st.session_state['_sesion_carga']\n"
+        f"ns = runpy.run_path({RUTA_APP!r}, run_name='app')\n"
+        f"ns[{modulo!r}]()\n"
+    )
+    at = AppTest.from_string(codigo, default_timeout=120)
+    at.session_state["_sesion_carga"] = uuid.uuid4().hex
+    for clave, valor in (estado or {}).items():
+        at.session_state[clave] = valor
+    return at
+
+
+def _medir(mediciones, accion, backend, at, funcion):
+    """Ejecuta una acción de usuario y registra su latencia, llamadas a la API y errores."""
+    sesion = at.session_state["_sesion_carga"]
+    antes = backend.total_llamadas(sesion)
+    inicio = time.perf_counter()
+    error = None
+    try:
+        at = funcion()
+        if at.exception:
+            error = at.exception[0].value
+        elif at.error:
+            error = at.error[0].value
+    except Exception as e:
+        error = repr(e)
+    mediciones.append({
+        "accion": accion,
+        "segundos": time.perf_counter() - inicio,
+        "llamadas": backend.total_llamadas(sesion) - antes,
+        "error": error,
+    })
+    return error is None
+
+
+def votante(i, backend, mediciones, equipos):
+    """Estudiante que valida correo y equipo y envía un voto."""
+    at = _sesion("modulo_votacion")
+    if not _medir(mediciones, "votación: abrir", backend, at, at.run):
+        return
+    at.text_input[0].input(f"estudiante{i}@itm.edu.co")
+    at.text_input[1].input(f"EQ{random.randrange(equipos):03d}")
+    if not _medir(mediciones, "votación: validar", backend, at, lambda: at.button[0].click().run()):
+        return
+    if not _medir(mediciones, "votación: formulario", backend, at, at.run) or not at.slider:
+        return
+    at.slider[0].set_value(random.randint(1, 5))
+    if not _medir(mediciones, "votación: slider", backend, at, at.run):
+        return
+    enviar = [b for b in at.button if "Enviar voto" in b.label]
+    _medir(mediciones, "votación: enviar", backend, at, lambda: enviar[0].click().run())
+
+
+def docente(i, backend, mediciones, equipos):
+    """Docente que abre el dashboard de inscripciones."""
+    at = _sesion("modulo_dashboard", {"rol": "Docente", "rol_seleccionado": True})
+    if _medir(mediciones, "dashboard: abrir", backend, at, at.run):
+        _medir(mediciones, "dashboard: refrescar", backend, at, at.run)
+
+
+def espectador(i, backend, mediciones, equipos, refrescos=3):
+    """Pantalla de resultados que se refresca varias veces."""
+    at = _sesion("modulo_resultados")
+    if not _medir(mediciones, "resultados: abrir", backend, at, at.run):
+        return
+    for _ in range(refrescos):
+        _medir(mediciones, "resultados: refrescar", backend, at, at.run)
+
+
+def reporte(mediciones, duracion, backend):
+    df = pd.DataFrame(mediciones)
+    filas = []
+    for accion, grupo in df.groupby("accion", sort=False):
+        ms = grupo["segundos"].to_numpy() * 1000
+        filas.append({
+            "acción": accion,
+            "n": len(grupo),
+            "p50 ms": np.percentile(ms, 50),
+            "p95 ms": np.percentile(ms, 95),
+            "p99 ms": np.percentile(ms, 99),
+            "llamadas/acción": grupo["llamadas"].mean(),
+            "errores": int(grupo["error"].notna().sum()),
+        })
+    tabla = pd.DataFrame(filas)
+    print(tabla.to_string(index=False, float_format=lambda x: f"{x:.1f}"))
+    print(f"\nAcciones: {len(df)} en {duracion:.1f} s  →  {len(df) / duracion:.1f} acciones/s")
+    print(f"Llamadas a la API de Sheets: {backend.total_llamadas()}  {dict(backend.llamadas)}")
+    print(f"  de hilos en segundo plano: {backend.total_llamadas('segundo plano')}")
+    if backend.rechazos:
+        print(f"Rechazos (cuota/errores inyectados): {dict(backend.rechazos)}")
+    errores = df["error"].dropna()
+    if not errores.empty:
+        print("Errores más frecuentes:")
+        print(errores.astype(str).str.slice(0, 120).value_counts().head(5).to_string())
+    return tabla
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga con Google Sheets simulado")
+    parser.add_argument("--votantes", type=int, default=30)
+    parser.add_argument("--docentes", type=int, default=5)
+    parser.add_argument("--espectadores", type=int, default=10)
+    parser.add_argument("--equipos", type=int, default=40)
+    parser.add_argument("--votos-previos", type=int, default=500)
+    parser.add_argument("--hilos", type=int, default=16, help="sesiones simultáneas")
+    parser.add_argument("--latencia", type=float, default=0.1, help="segundos por llamada a la API")
+    parser.add_argument("--cuota-lecturas", type=int, default=None, help="lecturas por minuto")
+    parser.add_argument("--cuota-escrituras", type=int, default=None, help="escrituras por minuto")
+    parser.add_argument("--errores", type=float, default=0.0, help="probabilidad de error 503")
+    parser.add_argument("--caida", type=float, nargs=2, metavar=("DESDE", "DURACION"), default=None,
+                        help="segundos tras el inicio y duración de una caída total (503)")
+    parser.add_argument("--motor", choices=["sheets", "sqlite"], default="sheets")
+    parser.add_argument("--sin-drive", action="store_true", help="sin detección de cambios por Drive")
+    args = parser.parse_args()
+
+    backend = SheetsSimulado(args.latencia, args.cuota_lecturas, args.cuota_escrituras, args.errores)
+    backend.poblar(args.equipos, votos=args.votos_previos).instalar(drive=not args.sin_drive)
+
+    directorio = tempfile.mkdtemp(prefix="pruebas_carga_")
+    secrets = {
+        "gcp": {"type": "service_account"},
+        "spreadsheet": {"id": "SIMULADO"},
+        "almacenamiento": {"motor": args.motor, "ruta": os.path.join(directorio, "concurso.db")},
+        "compartido": {"ruta": os.path.join(directorio, "estado_compartido.db")},
+    }
+    preparar_streamlit(secrets)
+    if args.caida:
+        backend.caer(*args.caida)
+
+    tareas = (
+        [(votante, i) for i in range(args.votantes)]
+        + [(docente, i) for i in range(args.docentes)]
+        + [(espectador, i) for i in range(args.espectadores)]
+    )
+    random.shuffle(tareas)
+
+    mediciones = []
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.hilos) as pool:
+        futuros = [pool.submit(f, i, backend, mediciones, args.equipos) for f, i in tareas]
+        for futuro in futuros:
+            try:
+                futuro.result()
+            except Exception as e:
+                # Un escenario que se cae a mitad de camino cuenta como error, sin abortar la prueba
+                mediciones.append({"accion": "escenario interrumpido", "segundos": 0.0, "llamadas": 0,
+                                   "error": repr(e)})
+    reporte(mediciones, time.perf_counter() - inicio, backend)
+
+
+if __name__ == "__main__":
+    main()